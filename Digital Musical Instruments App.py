@@ -1,16 +1,85 @@
 import sys
 import os
 import json
-import time
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QAction, QFileDialog, QToolBar, QSpinBox,
-    QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel, QDialog, QLineEdit, QStackedLayout
+    QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel, QDialog, QLineEdit, QStackedLayout, QDockWidget,
+    QComboBox, QFormLayout, QDialogButtonBox, QInputDialog, QMessageBox
 )
 from PyQt5.QtGui import QIcon, QColor, QPalette, QPixmap, QPainter
-from PyQt5.QtCore import Qt
-from instrument import MusicPlayer, note_to_frequency
+from PyQt5.QtCore import Qt, QEvent, QObject, QTimer, pyqtSignal
+from instrument import MusicPlayer
+from notes import note_table
+from score import compile_score
+from sequencer import Sequencer
+from latency import tracer
+from prewarm import Prewarmer
+from samplebank import SampleBank
+import lowlatency
+from effects import DEFAULT_EFFECTS
+from recorder import JOURNAL_SUFFIX, PerformanceRecorder, export_score, load_events
 
 CONFIG_FILE = "config.json"
+# Rendered notes kept across sessions, next to the configuration
+BANK_FILE = "samples.bank"
+
+# Instrument names as used by the synthesis and score modules
+INSTRUMENT_KEYS = {"Piano": "piano", "Xylophone": "xylophone", "Video Game": "videogame"}
+
+# Key styles, parsed by Qt once per button instead of on every press
+WHITE_KEY_STYLE = """
+    QPushButton {
+        background-color: white;
+        border: 1px solid black;
+        border-bottom-left-radius: 5px;
+        border-bottom-right-radius: 5px;
+    }
+"""
+WHITE_KEY_PRESSED_STYLE = "background-color: lightgray; border: 1px solid black;"
+BLACK_KEY_STYLE = "background-color: black; color: white; border: 1px solid black;"
+BLACK_KEY_PRESSED_STYLE = "background-color: #555555; color: white; border: 1px solid black;"
+XYLOPHONE_KEY_STYLE = """
+    QPushButton {{
+        background-color: {color};
+        color: black;
+        font-weight: bold;
+        font-size: 20px;
+        border-radius: 20px;
+        border: 2px solid black;
+    }}
+"""
+
+# Bars of the xylophone and pads of the video game layout, left to right
+XYLOPHONE_NOTES = ["Do", "Ré", "Mi", "Fa", "Sol", "La", "Si", "Do"]
+VIDEO_GAME_NOTES = ["Do", "Ré", "Mi", "Fa", "Sol", "La", "Si", "Do", "Ré", "Mi"]
+
+# Default key map — shared notes for other instruments (one octave only)
+BASE_KEY_MAP = {
+    Qt.Key_A: "Do", Qt.Key_Z: "Ré", Qt.Key_E: "Mi",
+    Qt.Key_R: "Fa", Qt.Key_T: "Sol", Qt.Key_Y: "La", Qt.Key_U: "Si",
+    Qt.Key_1: "Do#", Qt.Key_2: "Ré#", Qt.Key_4: "Fa#", Qt.Key_5: "Sol#", Qt.Key_3: "La#",
+}
+
+# Extended multi-octave map — only for piano
+PIANO_KEY_MAP = {
+    # Octave 1
+    Qt.Key_W: ("Do", 0), Qt.Key_X: ("Ré", 0), Qt.Key_C: ("Mi", 0),
+    Qt.Key_V: ("Fa", 0), Qt.Key_B: ("Sol", 0), Qt.Key_N: ("La", 0), Qt.Key_Comma: ("Si", 0),
+    Qt.Key_Ampersand: ("Do#", 0), Qt.Key_Eacute: ("Ré#", 0),
+    Qt.Key_ParenLeft: ("Fa#", 0), Qt.Key_Minus: ("Sol#", 0), Qt.Key_QuoteLeft: ("La#", 0),
+
+    # Octave 2
+    Qt.Key_A: ("Do", 1), Qt.Key_Z: ("Ré", 1), Qt.Key_E: ("Mi", 1),
+    Qt.Key_R: ("Fa", 1), Qt.Key_T: ("Sol", 1), Qt.Key_Y: ("La", 1), Qt.Key_U: ("Si", 1),
+    Qt.Key_1: ("Do#", 1), Qt.Key_2: ("Ré#", 1),
+    Qt.Key_4: ("Fa#", 1), Qt.Key_5: ("Sol#", 1), Qt.Key_3: ("La#", 1),
+
+    # Octave 3
+    Qt.Key_Q: ("Do", 2), Qt.Key_S: ("Ré", 2), Qt.Key_D: ("Mi", 2),
+    Qt.Key_F: ("Fa", 2), Qt.Key_G: ("Sol", 2), Qt.Key_H: ("La", 2), Qt.Key_J: ("Si", 2),
+    Qt.Key_6: ("Do#", 2), Qt.Key_7: ("Ré#", 2),
+    Qt.Key_9: ("Fa#", 2), Qt.Key_0: ("Sol#", 2), Qt.Key_8: ("La#", 2),
+}
 
 class RecordDialog(QDialog):
     def __init__(self):
@@ -33,25 +102,145 @@ class RecordDialog(QDialog):
         return self.line_edit.text()
 
 
+class AudioSettingsDialog(QDialog):
+    """Sample rate, buffer size and channels of the audio device, with auto-tuning."""
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Audio Device")
+        layout = QVBoxLayout()
+        form = QFormLayout()
+
+        self.rate_box = QComboBox()
+        for rate in lowlatency.SAMPLE_RATES:
+            self.rate_box.addItem(f"{rate} Hz", rate)
+        self.buffer_box = QComboBox()
+        for size in sorted(lowlatency.BUFFER_SIZES):
+            self.buffer_box.addItem(f"{size} frames", size)
+        self.channels_box = QComboBox()
+        self.channels_box.addItem("Mono", 1)
+        self.channels_box.addItem("Stereo", 2)
+        form.addRow("Sample rate", self.rate_box)
+        form.addRow("Buffer size", self.buffer_box)
+        form.addRow("Channels", self.channels_box)
+        self.set_settings(settings)
+
+        self.report_label = QLabel("Auto-tune finds the smallest buffer this machine plays without underruns.")
+        self.report_label.setStyleSheet("font-family: monospace;")
+        self.autotune_button = QPushButton("Auto-tune")
+        self.autotune_button.clicked.connect(self.autotune)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout.addLayout(form)
+        layout.addWidget(self.autotune_button)
+        layout.addWidget(self.report_label)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def set_settings(self, settings):
+        for box, value in ((self.rate_box, settings["sample_rate"]), (self.buffer_box, settings["buffer_size"]),
+                           (self.channels_box, settings["channels"])):
+            index = box.findData(value)
+            if index < 0:
+                box.addItem(str(value), value)
+                index = box.count() - 1
+            box.setCurrentIndex(index)
+
+    def settings(self):
+        return {"sample_rate": self.rate_box.currentData(), "buffer_size": self.buffer_box.currentData(),
+                "channels": self.channels_box.currentData()}
+
+    def autotune(self):
+        # Tuning opens the device itself: the player lets go of it first
+        self.parent().release_audio_device()
+        settings = self.settings()
+        lines = []
+
+        def step(result):
+            lines.append(lowlatency.format_result(result))
+            self.report_label.setText("\n".join(lines))
+            QApplication.processEvents()
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            settings, _ = lowlatency.autotune(settings["sample_rate"], settings["channels"], on_step=step)
+        except RuntimeError as e:
+            lines.append(str(e))
+        else:
+            lines.append(f"Smallest stable buffer: {settings['buffer_size']} frames")
+            self.set_settings(settings)
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.report_label.setText("\n".join(lines))
+
+
+class SequencerSignals(QObject):
+    # Carries the sequencer's end-of-score report back to the GUI thread
+    finished = pyqtSignal(dict)
+
+
+class PrewarmSignals(QObject):
+    # Carries pre-warming progress (done, total) back to the GUI thread
+    progress = pyqtSignal(int, int)
+
+
 class InstrumentApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Digital Musical Instruments")
         self.setGeometry(100, 100, 1200, 500)
 
-        self.player = MusicPlayer()
         self.current_instrument = "Piano"
         self.octaves = 2
-        self.recording = False
-        self.recorded_notes = []
+        # Sample rate, buffer size and channels of the audio device
+        self.audio_settings = dict(lowlatency.DEFAULT_SETTINGS)
+        # Reverb and delay on the output mix
+        self.effect_settings = dict(DEFAULT_EFFECTS)
+        self.load_config()
+
+        # Live playing must never block the GUI thread; notes overlap freely
+        # and are mixed block by block by the streaming engine. The audio
+        # device is opened once the window is up (see below). Notes in the
+        # sample bank stream from it instead of being synthesized
+        self.player = MusicPlayer(blocking=False, streaming=True, bank=SampleBank(BANK_FILE),
+                                  sample_rate=self.audio_settings["sample_rate"],
+                                  block_size=self.audio_settings["buffer_size"],
+                                  output_channels=self.audio_settings["channels"])
+        self.player.set_effects(self.effect_settings)
+        # Note events are timestamped and journaled to disk while recording
+        self.recorder = PerformanceRecorder()
         self.record_name = ""
 
-        self.load_config()
+        # Keyboard notes currently held down: Qt key -> player note handle
+        self.held_notes = {}
+        self.key_dispatch_cache = {}
+
+        # Scores play from a background thread so the GUI stays responsive
+        self.sequencer_signals = SequencerSignals()
+        self.sequencer_signals.finished.connect(self.score_finished)
+        self.sequencer = Sequencer(self.player, on_finished=self.sequencer_signals.finished.emit)
+        self.score_instrument = self.score_name = None
+
+        # Notes of the active layout are prepared in the background; a key
+        # pressed before its note is ready synthesizes it on the spot
+        self.prewarm_signals = PrewarmSignals()
+        self.prewarm_signals.progress.connect(self.prewarm_progress)
+        self.prewarmer = Prewarmer(self.player, on_progress=self.prewarm_signals.progress.emit)
 
         self.create_menu()
         self.create_toolbar()
         self.create_main_ui()
+        self.create_latency_panel()
         self.show()
+        # Open the audio device from the event loop, after the window has
+        # been mapped, rather than delaying its first appearance
+        QTimer.singleShot(0, self.open_audio)
+
+    def open_audio(self):
+        self.player.open()
+        self.prewarm_layout()
 
     def create_menu(self):
         menu = self.menuBar().addMenu("Menu")
@@ -69,6 +258,51 @@ class InstrumentApp(QMainWindow):
         self.stop_action.setShortcut("Ctrl+S")
         self.stop_action.triggered.connect(self.stop_recording)
 
+        self.pause_action = QAction("Pause / Resume Score", self)
+        self.pause_action.setShortcut("Ctrl+P")
+        self.pause_action.triggered.connect(self.sequencer.toggle_pause)
+
+        self.stop_score_action = QAction("Stop Score", self)
+        self.stop_score_action.setShortcut("Ctrl+Shift+S")
+        self.stop_score_action.triggered.connect(self.stop_score)
+
+        self.seek_action = QAction("Play From...", self)
+        self.seek_action.setShortcut("Ctrl+J")
+        self.seek_action.triggered.connect(self.seek_score)
+
+        self.tempo_action = QAction("Tempo...", self)
+        self.tempo_action.triggered.connect(self.set_score_tempo)
+
+        self.loop_action = QAction("Loop Region...", self)
+        self.loop_action.triggered.connect(self.set_score_loop)
+
+        self.latency_action = QAction("Latency Monitor", self)
+        self.latency_action.setCheckable(True)
+        self.latency_action.toggled.connect(self.toggle_latency_monitor)
+
+        self.capture_action = QAction("Capture Audio...", self)
+        self.capture_action.setCheckable(True)
+        self.capture_action.toggled.connect(self.toggle_audio_capture)
+
+        self.audio_device_action = QAction("Audio Device...", self)
+        self.audio_device_action.triggered.connect(self.configure_audio_device)
+
+        self.reverb_action = QAction("Reverb", self)
+        self.reverb_action.setCheckable(True)
+        self.reverb_action.setChecked(self.effect_settings["reverb"])
+        self.reverb_action.toggled.connect(lambda enabled: self.set_effect("reverb", enabled))
+
+        self.delay_action = QAction("Delay", self)
+        self.delay_action.setCheckable(True)
+        self.delay_action.setChecked(self.effect_settings["delay"])
+        self.delay_action.toggled.connect(lambda enabled: self.set_effect("delay", enabled))
+
+        self.impulse_response_action = QAction("Reverb Impulse Response...", self)
+        self.impulse_response_action.triggered.connect(self.choose_impulse_response)
+
+        self.dump_latency_action = QAction("Save Latency Report...", self)
+        self.dump_latency_action.triggered.connect(self.dump_latency_report)
+
         self.quit_action = QAction(QIcon("quit.png"), "Quit", self)
         self.quit_action.setShortcut("Ctrl+Q")
         self.quit_action.triggered.connect(self.close)
@@ -77,6 +311,18 @@ class InstrumentApp(QMainWindow):
         menu.addAction(self.open_action)
         menu.addAction(self.record_action)
         menu.addAction(self.stop_action)
+        menu.addAction(self.capture_action)
+        menu.addAction(self.pause_action)
+        menu.addAction(self.stop_score_action)
+        menu.addAction(self.seek_action)
+        menu.addAction(self.tempo_action)
+        menu.addAction(self.loop_action)
+        menu.addAction(self.latency_action)
+        menu.addAction(self.dump_latency_action)
+        menu.addAction(self.audio_device_action)
+        menu.addAction(self.reverb_action)
+        menu.addAction(self.delay_action)
+        menu.addAction(self.impulse_response_action)
         menu.addAction(self.quit_action)
 
 
@@ -114,6 +360,8 @@ class InstrumentApp(QMainWindow):
         self.main_layout = QVBoxLayout()
         self.instrument_area = QWidget()
         self.instrument_stack = QStackedLayout()
+        self.instrument_pages = {}  # (instrument, octaves) -> stack index
+        self.dark_icons = {}  # Video game pad -> its pressed icon
         self.instrument_area.setLayout(self.instrument_stack)
 
         center_layout = QHBoxLayout()
@@ -128,16 +376,37 @@ class InstrumentApp(QMainWindow):
         self.build_instrument_ui()
 
 
+    def create_latency_panel(self):
+        # Hidden until the latency monitor is switched on from the menu
+        self.latency_label = QLabel()
+        self.latency_label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+        self.latency_label.setStyleSheet("font-family: monospace;")
+        self.latency_dock = QDockWidget("Note latency", self)
+        self.latency_dock.setWidget(self.latency_label)
+        self.latency_dock.setFeatures(QDockWidget.NoDockWidgetFeatures)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.latency_dock)
+        self.latency_dock.hide()
+
+        self.latency_timer = QTimer(self)
+        self.latency_timer.setInterval(500)
+        self.latency_timer.timeout.connect(self.refresh_latency_panel)
+
+
     def build_instrument_ui(self):
-        while self.instrument_stack.count():
-            widget = self.instrument_stack.takeAt(0).widget()
-            if widget:
-                widget.setParent(None)
+        # Each instrument (and piano size) is built once, then kept in the
+        # stack: switching back to it only changes the current index
+        layout_key = (self.current_instrument, self.octaves if self.current_instrument == "Piano" else None)
+        if layout_key not in self.instrument_pages:
+            if self.current_instrument == "Piano":
+                page = self.build_piano_keys()
+            elif self.current_instrument == "Xylophone":
+                page = self.build_xylophone_keys()
+            else:
+                page = self.build_videogame_keys()
+            self.instrument_pages[layout_key] = self.instrument_stack.addWidget(page)
+        self.instrument_stack.setCurrentIndex(self.instrument_pages[layout_key])
 
         if self.current_instrument == "Piano":
-            piano_widget = self.build_piano_keys()
-            self.instrument_stack.addWidget(piano_widget)
-
             # --- Calculate the piano size ---
             key_width = 60
             number_of_white_keys = 7 * self.octaves
@@ -154,9 +423,6 @@ class InstrumentApp(QMainWindow):
             self.instrument_area.setFixedWidth(piano_width)
 
         elif self.current_instrument == "Xylophone":
-            xylophone_widget = self.build_xylophone_keys()
-            self.instrument_stack.addWidget(xylophone_widget)
-
             # --- Set window size appropriate for xylophone ---
             total_width = 700
             total_height = 400
@@ -164,9 +430,6 @@ class InstrumentApp(QMainWindow):
             self.instrument_area.setFixedWidth(total_width - 100)
 
         elif self.current_instrument == "Video Game":
-            videogame_widget = self.build_videogame_keys()
-            self.instrument_stack.addWidget(videogame_widget)
-
             # --- Set window size appropriate for video game keys ---
             button_width = 64
             number_of_buttons = 10
@@ -177,6 +440,36 @@ class InstrumentApp(QMainWindow):
             self.setFixedSize(total_width, total_height)
             self.instrument_area.setFixedWidth(total_width - 100)
 
+        self.prewarm_layout()
+
+
+    def playable_notes(self):
+        # (instrument key, frequency, duration) of every note the current
+        # layout can play, from its on-screen keys and from the keyboard
+        if self.current_instrument == "Piano":
+            first = note_table.index("Do", 0)
+            keys = [(midi, 0.5) for midi in range(first, first + 12 * self.octaves)]
+        elif self.current_instrument == "Xylophone":
+            keys = [(note_table.index(note, 0), 0.5) for note in XYLOPHONE_NOTES]
+        else:
+            keys = [(note_table.index(note, 2), 0.2) for note in VIDEO_GAME_NOTES]
+        keys += [(midi, duration) for midi, _, _, duration in self.key_dispatch().values()]
+        instrument = INSTRUMENT_KEYS[self.current_instrument]
+        return [(instrument, float(note_table.frequencies[midi]), duration) for midi, duration in keys]
+
+    def prewarm_layout(self):
+        # Until the audio device is open, open_audio() will do it
+        if self.player.is_open:
+            self.prewarmer.start(self.playable_notes())
+
+    def prewarm_progress(self, done, total):
+        if self.sequencer.playing:
+            return  # Leave the score's message in place
+        if done < total:
+            self.statusBar().showMessage(f"Preparing {self.current_instrument} notes: {done}/{total}")
+        else:
+            self.statusBar().showMessage(f"{self.current_instrument} ready", 2000)
+
 
     def build_piano_keys(self):
         widget = QWidget()
@@ -200,14 +493,7 @@ class InstrumentApp(QMainWindow):
                 w_btn = QPushButton(note, piano_area)
                 x = (o * 7 + i) * key_width
                 w_btn.setGeometry(x, 50, key_width, key_height)
-                w_btn.setStyleSheet("""
-                    QPushButton {
-                        background-color: white;
-                        border: 1px solid black;
-                        border-bottom-left-radius: 5px;
-                        border-bottom-right-radius: 5px;
-                    }
-                """)
+                w_btn.setStyleSheet(WHITE_KEY_STYLE)
                 w_btn.clicked.connect(lambda checked, n=note, oc=o: self.play_note(n, oc))
                 w_btn.pressed.connect(lambda btn=w_btn: self.press_key_effect(btn, "white"))
                 w_btn.released.connect(lambda btn=w_btn: self.release_key_effect(btn, "white"))
@@ -220,7 +506,7 @@ class InstrumentApp(QMainWindow):
                     b_btn = QPushButton(bnote, piano_area)
                     x = ((o * 7 + i) * key_width) + (key_width - black_key_width // 2)
                     b_btn.setGeometry(x, 50, black_key_width, black_key_height)
-                    b_btn.setStyleSheet("background-color: black; color: white; border: 1px solid black;")
+                    b_btn.setStyleSheet(BLACK_KEY_STYLE)
                     b_btn.clicked.connect(lambda checked, n=bnote, oc=o: self.play_note(n, oc))
                     b_btn.pressed.connect(lambda btn=b_btn: self.press_key_effect(btn, "black"))
                     b_btn.released.connect(lambda btn=b_btn: self.release_key_effect(btn, "black"))
@@ -231,16 +517,16 @@ class InstrumentApp(QMainWindow):
 
     def press_key_effect(self, btn, color):
         if color == "white":
-            btn.setStyleSheet("background-color: lightgray; border: 1px solid black;")
+            btn.setStyleSheet(WHITE_KEY_PRESSED_STYLE)
         else:  # black key
-            btn.setStyleSheet("background-color: #555555; color: white; border: 1px solid black;")
+            btn.setStyleSheet(BLACK_KEY_PRESSED_STYLE)
         btn.resize(btn.width()-2, btn.height()-2)
 
     def release_key_effect(self, btn, color):
         if color == "white":
-            btn.setStyleSheet("background-color: white; border: 1px solid black;")
+            btn.setStyleSheet(WHITE_KEY_STYLE)
         else:  # black key
-            btn.setStyleSheet("background-color: black; color: white; border: 1px solid black;")
+            btn.setStyleSheet(BLACK_KEY_STYLE)
         btn.resize(btn.width()+2, btn.height()+2)
 
 
@@ -251,30 +537,22 @@ class InstrumentApp(QMainWindow):
         layout.setContentsMargins(20, 20, 20, 20)
 
         colors = ["#C71585", "#800080", "#0000FF", "#00FF00", "#FFFF00", "#FFA500", "#FF0000", "#FF69B4"]
-        notes = ["Do", "Ré", "Mi", "Fa", "Sol", "La", "Si", "Do"]
         widths = [60, 60, 55, 55, 50, 50, 45, 45]
         heights = [270, 270, 250, 230, 210, 190, 170, 150]
 
         self.xylophone_keys = []
 
-        for i, note in enumerate(notes):
+        for i, note in enumerate(XYLOPHONE_NOTES):
             btn = QPushButton(note)
             btn.setFixedSize(widths[i], heights[i])
-            btn.setStyleSheet(f"""
-                QPushButton {{
-                    background-color: {colors[i]};
-                    color: black;
-                    font-weight: bold;
-                    font-size: 20px;
-                    border-radius: 20px;
-                    border: 2px solid black;
-                }}
-            """)
+            style = XYLOPHONE_KEY_STYLE.format(color=colors[i])
+            pressed_style = XYLOPHONE_KEY_STYLE.format(color=self.darken_color(colors[i], 0.5))
+            btn.setStyleSheet(style)
             btn.clicked.connect(lambda checked, n=note, oc=0: self.play_note(n, oc))
 
             # Add pressed and released effects
-            btn.pressed.connect(lambda btn=btn, color=colors[i]: self.press_xylophone_key(btn, color))
-            btn.released.connect(lambda btn=btn, color=colors[i]: self.release_xylophone_key(btn, color))
+            btn.pressed.connect(lambda btn=btn, style=pressed_style: self.press_xylophone_key(btn, style))
+            btn.released.connect(lambda btn=btn, style=style: self.release_xylophone_key(btn, style))
 
             layout.addWidget(btn)
             self.xylophone_keys.append(btn)
@@ -282,29 +560,11 @@ class InstrumentApp(QMainWindow):
         widget.setLayout(layout)
         return widget
     
-    def press_xylophone_key(self, btn, color):
-        btn.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {self.darken_color(color, 0.5)};
-                color: black;
-                font-weight: bold;
-                font-size: 20px;
-                border-radius: 20px;
-                border: 2px solid black;
-            }}
-        """)
-
-    def release_xylophone_key(self, btn, color):
-        btn.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {color};
-                color: black;
-                font-weight: bold;
-                font-size: 20px;
-                border-radius: 20px;
-                border: 2px solid black;
-            }}
-        """)
+    def press_xylophone_key(self, btn, pressed_style):
+        btn.setStyleSheet(pressed_style)
+
+    def release_xylophone_key(self, btn, style):
+        btn.setStyleSheet(style)
 
     def darken_color(self, hex_color, factor):
         """Helper to darken a hex color by a factor."""
@@ -320,8 +580,7 @@ class InstrumentApp(QMainWindow):
         layout.setSpacing(10)
         layout.setContentsMargins(20, 20, 20, 20)
         
-        # List of notes and corresponding images
-        notes = ["Do", "Ré", "Mi", "Fa", "Sol", "La", "Si", "Do", "Ré", "Mi"]
+        # Images of the pads, in the order of VIDEO_GAME_NOTES
         images = [
             "super-mario.png",
             "super-mario1.png",
@@ -335,20 +594,20 @@ class InstrumentApp(QMainWindow):
             "le-manoir-de-luigi.png",
         ]
 
-        for i, note in enumerate(notes):
+        image_dir = os.path.join(os.path.dirname(__file__), "images")
+        for i, note in enumerate(VIDEO_GAME_NOTES):
             btn = QPushButton()
             btn.setFixedSize(64, 64)
-            image_dir = os.path.join(os.path.dirname(__file__), "images")
-            icon_path = os.path.join(image_dir, images[i])
+            pixmap = QPixmap(os.path.join(image_dir, images[i]))
 
-            icon = QIcon(icon_path)
+            icon = QIcon(pixmap)
             btn.setIcon(icon)
             btn.setIconSize(btn.size())
             btn.setStyleSheet("border: none;")
 
             btn.clicked.connect(lambda checked, n=note: self.play_video_game_note(n))
-            btn.pressed.connect(lambda checked=False, b=btn, p=icon_path: self.press_videogame_key(b, p))
-            btn.released.connect(lambda checked=False, b=btn, p=icon_path: self.release_videogame_key(b, p))
+            btn.pressed.connect(lambda checked=False, b=btn, p=pixmap: self.press_videogame_key(b, p))
+            btn.released.connect(lambda checked=False, b=btn, i=icon: self.release_videogame_key(b, i))
 
             layout.addWidget(btn)
 
@@ -357,17 +616,17 @@ class InstrumentApp(QMainWindow):
 
 
     def play_video_game_note(self, note):
-        base_frequency = note_to_frequency[note][2]  # Take the base low octave
+        tracer.begin(self.current_instrument)
+        base_frequency = note_table.frequency(note, 2)  # Two octaves above the piano's first one
+        tracer.mark("lookup")
         #frequency = base_frequency * (2**3)  # Raise octaves (ex: 2^3 = 8 times higher)
         duration = 0.2  # Short punchy sound
         #self.player.play_videoGame_tone(frequency, duration)
         self.player.play_videoGame_tone(base_frequency, duration)
         
-        if self.recording:
-            self.recorded_notes.append((note, duration))
+        self.recorder.note(note_table.index(note, 2), duration)
 
-    def press_videogame_key(self, btn, image_path):
-        pixmap = QPixmap(image_path)
+    def darken_pixmap(self, pixmap):
         dark_pixmap = QPixmap(pixmap.size())
         dark_pixmap.fill(Qt.transparent)
 
@@ -375,15 +634,24 @@ class InstrumentApp(QMainWindow):
         painter.setOpacity(0.5)  # 50% darkness
         painter.drawPixmap(0, 0, pixmap)
         painter.end()
+        return dark_pixmap
 
-        btn.setIcon(QIcon(dark_pixmap))
+    def press_videogame_key(self, btn, pixmap):
+        # The pressed state is drawn the first time a pad is pressed, then
+        # kept: pressing it again only swaps icons
+        dark_icon = self.dark_icons.get(btn)
+        if dark_icon is None:
+            dark_icon = self.dark_icons[btn] = QIcon(self.darken_pixmap(pixmap))
+        btn.setIcon(dark_icon)
 
-    def release_videogame_key(self, btn, image_path):
-        btn.setIcon(QIcon(QPixmap(image_path)))
+    def release_videogame_key(self, btn, icon):
+        btn.setIcon(icon)
 
 
     def play_note(self, note, octave):
-        frequency = note_to_frequency[note][octave]
+        tracer.begin(self.current_instrument)
+        frequency = note_table.frequency(note, octave)
+        tracer.mark("lookup")
         duration = 0.5
         if self.current_instrument == "Piano":
             self.player.play_piano_tone(frequency, duration)
@@ -391,61 +659,193 @@ class InstrumentApp(QMainWindow):
             self.player.play_xylophone_tone(frequency, duration)
         elif self.current_instrument == "Video Game":
             self.player.play_videoGame_tone(frequency, duration)
-        if self.recording:
-            self.recorded_notes.append((note, 0.5))  # Assuming default duration = 0.5 seconds
+        self.recorder.note(note_table.index(note, octave), duration)
 
 
     def open_score(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Open Score", "", "Text Files (*.txt)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "Open Score", "", "Scores (*.txt *.mid *.midi);;Text Files (*.txt);;MIDI Files (*.mid *.midi)")
         if file_name:
-            with open(file_name, 'r') as f:
-                lines = f.readlines()
-                for line in lines:
-                    parts = line.strip().split()
-                    if len(parts) == 2:
-                        note, duration = parts
-                        try:
-                            duration = float(duration)
-                        except ValueError:
-                            continue
-                        if note == '0' or note == 'Unknown':
-                            time.sleep(duration)
-                        elif note in note_to_frequency:
-                            freq_data = note_to_frequency[note]
-                            if isinstance(freq_data, tuple):
-                                if self.current_instrument == "Video Game":
-                                    frequency = freq_data[2]
-                                else:
-                                    frequency = freq_data[0]
-                            else:
-                                frequency = freq_data
-                            if self.current_instrument == "Piano":
-                                self.player.play_piano_tone(frequency, duration)
-                            elif self.current_instrument == "Xylophone":
-                                self.player.play_xylophone_tone(frequency, duration)
-                            elif self.current_instrument == "Video Game":
-                                self.player.play_videoGame_tone(frequency, duration)
-                        else:
-                            print(f"Note {note} not recognized.")
-
+            # Parsing and note lookups happen once, before playback starts
+            try:
+                score = compile_score(file_name, INSTRUMENT_KEYS[self.current_instrument])
+            except (OSError, ValueError) as e:
+                # Unreadable, truncated or corrupt file: report it, keep the app running
+                QMessageBox.warning(self, "Open Score", f"Could not open {os.path.basename(file_name)}:\n{e}")
+                return
+            self.score_instrument = INSTRUMENT_KEYS[self.current_instrument]
+            self.score_name = os.path.basename(file_name)
+            self.sequencer.start(score, self.score_instrument)
+            self.statusBar().showMessage(f"Playing {self.score_name}")
+
+    def seek_score(self):
+        score = self.sequencer.score
+        if score is None:
+            self.statusBar().showMessage("Open a score first")
+            return
+        text, ok = QInputDialog.getText(
+            self, "Play From", f"Seconds (0 - {score.length:.1f}) or #note number (1 - {len(score)}):")
+        text = text.strip()
+        if not ok or not text:
+            return
+        try:
+            if text.startswith("#"):
+                index = min(max(int(text[1:]) - 1, 0), max(len(score) - 1, 0))
+                position = float(score.notes["start"][index]) if len(score) else 0.0
+            else:
+                position = min(max(float(text), 0.0), score.length)
+        except ValueError:
+            QMessageBox.warning(self, "Play From", f"Not a time or note number: {text}")
+            return
+        if self.sequencer.playing:
+            self.sequencer.seek(position)
+        else:
+            self.sequencer.start(score, self.score_instrument, position)
+        note = self.sequencer.note_at(position) + 1
+        self.statusBar().showMessage(f"Playing {self.score_name} from {position:.2f} s (note {note})")
+
+    def set_score_tempo(self):
+        tempo, ok = QInputDialog.getDouble(self, "Tempo", "Tempo multiplier (1 = as written):",
+                                           self.sequencer.tempo, 0.25, 4.0, 2)
+        if ok:
+            self.sequencer.set_tempo(tempo)
+            self.statusBar().showMessage(f"Tempo x{tempo:.2f}")
+
+    def set_score_loop(self):
+        loop = self.sequencer.loop
+        current = f"{loop[0]:g} {loop[1]:g}" if loop else ""
+        text, ok = QInputDialog.getText(self, "Loop Region", "Start and end in seconds (empty: no loop):",
+                                        QLineEdit.Normal, current)
+        if not ok:
+            return
+        try:
+            if text.strip():
+                start, end = (float(value) for value in text.replace(",", " ").split())
+                self.sequencer.set_loop(start, end)
+                self.statusBar().showMessage(f"Looping {start:g} - {end:g} s")
+            else:
+                self.sequencer.set_loop()
+                self.statusBar().showMessage("Loop cleared")
+        except ValueError:
+            QMessageBox.warning(self, "Loop Region", f"Expected a start and an end time: {text}")
+
+    def stop_score(self):
+        self.sequencer.stop()
+        self.player.stop_all()
+        self.statusBar().clearMessage()
+
+    def score_finished(self, jitter):
+        self.statusBar().showMessage(
+            f"Score finished: {jitter['notes']} notes, onset jitter "
+            f"mean {jitter['mean_ms']:.2f} ms, p95 {jitter['p95_ms']:.2f} ms, max {jitter['max_ms']:.2f} ms"
+        )
+
+
+    def toggle_latency_monitor(self, enabled):
+        tracer.enabled = enabled
+        self.latency_dock.setVisible(enabled)
+        if enabled:
+            tracer.clear()
+            self.refresh_latency_panel()
+            self.latency_timer.start()
+        else:
+            self.latency_timer.stop()
+
+    def refresh_latency_panel(self):
+        summary = tracer.summary()
+        if not summary:
+            self.latency_label.setText("Play a few notes...")
+            return
+        lines = [f"{'':<22}{'p50':>8}{'p95':>8}{'p99':>8}  (ms)"]
+        for instrument, stages in summary.items():
+            lines.append(f"{instrument}  ({stages['total']['count']} notes)" if "total" in stages else instrument)
+            for stage, stats in stages.items():
+                lines.append(f"  {stage:<20}{stats['p50_ms']:>8.2f}{stats['p95_ms']:>8.2f}{stats['p99_ms']:>8.2f}")
+        self.latency_label.setText("\n".join(lines))
+
+    def dump_latency_report(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Latency Report", "latency.json", "JSON Files (*.json)")
+        if file_name:
+            tracer.dump(file_name)
+
+
+    def toggle_audio_capture(self, enabled):
+        if not enabled:
+            capture = self.player.stop_capture()
+            if capture is not None:
+                seconds = capture.frames_written / capture.sample_rate
+                self.statusBar().showMessage(f"Saved {seconds:.1f} s of audio to {capture.path}", 5000)
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Capture Audio", "capture.wav", "WAV Files (*.wav)")
+        if not file_name:
+            self.capture_action.setChecked(False)
+            return
+        self.player.start_capture(file_name)
+
+    def release_audio_device(self):
+        # Silence everything that holds the device, then close it
+        self.capture_action.setChecked(False)
+        self.release_held_notes()
+        self.sequencer.stop()
+        self.prewarmer.cancel(wait=True)
+        self.player.configure()
+
+    def configure_audio_device(self):
+        dialog = AudioSettingsDialog(self.audio_settings, self)
+        accepted = dialog.exec_()
+        if accepted:
+            self.audio_settings = dialog.settings()
+            self.save_config()
+        if accepted or not self.player.is_open:
+            # Reopened with the new settings, or the old ones after an auto-tune
+            self.release_audio_device()
+            self.player.configure(self.audio_settings["sample_rate"], self.audio_settings["buffer_size"],
+                                  self.audio_settings["channels"])
+            self.open_audio()
+            settings = self.audio_settings
+            self.statusBar().showMessage(
+                f"Audio device: {settings['sample_rate']} Hz, {settings['buffer_size']} frames "
+                f"({self.player.latency * 1000:.1f} ms buffer), {settings['channels']} channel(s)", 5000)
+
+    def set_effect(self, name, value):
+        self.effect_settings[name] = value
+        self.save_config()
+        if not self.player.set_effects(self.effect_settings):
+            self.statusBar().showMessage("Effects need the streaming audio engine", 5000)
+
+    def choose_impulse_response(self):
+        choice, ok = QInputDialog.getItem(self, "Reverb Impulse Response", "Impulse response:",
+                                          ["Generated room", "WAV file..."], 0, False)
+        if not ok:
+            return
+        if choice == "WAV file...":
+            file_name, _ = QFileDialog.getOpenFileName(self, "Impulse Response", "", "WAV Files (*.wav)")
+            if not file_name:
+                return
+        else:
+            file_name = None
+        self.set_effect("impulse_response", file_name)
+        self.reverb_action.setChecked(True)
 
     def record_music(self):
         dialog = RecordDialog()
         if dialog.exec_():
             self.record_name = dialog.get_name()
-            self.recorded_notes = []
-            self.recording = True
+            if self.record_name:
+                self.recorder.start(self.record_name + JOURNAL_SUFFIX)
 
     def stop_recording(self):
-        if self.recording and self.record_name:
-            with open(f"{self.record_name}.txt", "w") as f:
-                for note, duration in self.recorded_notes:
-                    f.write(f"{note} {duration}\n")
-        self.recording = False
+        if not self.recorder.recording:
+            return
+        self.recorder.stop()
+        journal = self.recorder.path
+        export_score(load_events(journal), f"{self.record_name}.txt")
+        # The journal is only needed to recover a take that was never exported
+        os.remove(journal)
 
 
     def change_instrument(self, instrument):
         self.current_instrument = instrument
+        self.release_held_notes()
         self.build_instrument_ui()
         self.save_config()
 
@@ -457,7 +857,10 @@ class InstrumentApp(QMainWindow):
     def save_config(self):
         config = {
             "instrument": self.current_instrument,
-            "octaves": self.octaves
+            "octaves": self.octaves,
+            "reference_pitch": note_table.reference_pitch,
+            "audio": self.audio_settings,
+            "effects": self.effect_settings,
         }
         with open(CONFIG_FILE, 'w') as f:
             json.dump(config, f)
@@ -468,65 +871,77 @@ class InstrumentApp(QMainWindow):
                 config = json.load(f)
                 self.current_instrument = config.get("instrument", "Piano")
                 self.octaves = config.get("octaves", 2)
-
+                note_table.set_reference_pitch(config.get("reference_pitch", 440.0))
+                self.audio_settings.update(config.get("audio", {}))
+                self.effect_settings.update(config.get("effects", {}))
+
+
+    def release_held_notes(self):
+        for handle, midi in self.held_notes.values():
+            self.player.note_off(handle)
+            self.recorder.note_off(midi)
+        self.held_notes.clear()
+
+    def changeEvent(self, event):
+        # Key releases go to whichever window has focus: drop held notes when we lose it
+        if event.type() == QEvent.ActivationChange and not self.isActiveWindow():
+            self.release_held_notes()
+        super().changeEvent(event)
+
+    def closeEvent(self, event):
+        self.release_held_notes()
+        self.stop_recording()
+        self.sequencer.stop()
+        self.prewarmer.shutdown()
+        self.player.close()
+        super().closeEvent(event)
+
+
+    def key_dispatch(self):
+        # Qt key -> (MIDI note, instrument key, frequency, duration) for the current
+        # instrument, built once per instrument and tuning
+        cache_key = (self.current_instrument, note_table.reference_pitch)
+        if cache_key not in self.key_dispatch_cache:
+            instrument = INSTRUMENT_KEYS[self.current_instrument]
+            duration = 0.2 if self.current_instrument == "Video Game" else 0.5
+            # Use extended mapping only for piano
+            if self.current_instrument == "Piano":
+                key_map = PIANO_KEY_MAP
+            else:
+                key_map = {k: (v, 0) for k, v in BASE_KEY_MAP.items()}  # Default to octave 0
+            dispatch = {}
+            for key, (note, octave) in key_map.items():
+                if self.current_instrument == "Video Game":
+                    octave = 2
+                midi = note_table.index(note, octave)
+                dispatch[key] = (midi, instrument, float(note_table.frequencies[midi]), duration)
+            self.key_dispatch_cache[cache_key] = dispatch
+        return self.key_dispatch_cache[cache_key]
 
     def keyPressEvent(self, event):
+        # Held keys repeat their press events; only the first one plays
+        if event.isAutoRepeat():
+            return
         key = event.key()
-
-        # Default key map — shared notes for other instruments (one octave only)
-        base_key_map = {
-            Qt.Key_A: "Do", Qt.Key_Z: "Ré", Qt.Key_E: "Mi",
-            Qt.Key_R: "Fa", Qt.Key_T: "Sol", Qt.Key_Y: "La", Qt.Key_U: "Si",
-            Qt.Key_1: "Do#", Qt.Key_2: "Ré#", Qt.Key_4: "Fa#", Qt.Key_5: "Sol#", Qt.Key_3: "La#",
-        }
-
-        # Extended multi-octave map — only for piano
-        piano_key_map = {
-            # Octave 1
-            Qt.Key_W: ("Do", 0), Qt.Key_X: ("Ré", 0), Qt.Key_C: ("Mi", 0),
-            Qt.Key_V: ("Fa", 0), Qt.Key_B: ("Sol", 0), Qt.Key_N: ("La", 0), Qt.Key_Comma: ("Si", 0),
-            Qt.Key_Ampersand: ("Do#", 0), Qt.Key_Eacute: ("Ré#", 0),
-            Qt.Key_ParenLeft: ("Fa#", 0), Qt.Key_Minus: ("Sol#", 0), Qt.Key_QuoteLeft: ("La#", 0),
-
-            # Octave 2
-            Qt.Key_A: ("Do", 1), Qt.Key_Z: ("Ré", 1), Qt.Key_E: ("Mi", 1),
-            Qt.Key_R: ("Fa", 1), Qt.Key_T: ("Sol", 1), Qt.Key_Y: ("La", 1), Qt.Key_U: ("Si", 1),
-            Qt.Key_1: ("Do#", 1), Qt.Key_2: ("Ré#", 1),
-            Qt.Key_4: ("Fa#", 1), Qt.Key_5: ("Sol#", 1), Qt.Key_3: ("La#", 1),
-
-            # Octave 3
-            Qt.Key_Q: ("Do", 2), Qt.Key_S: ("Ré", 2), Qt.Key_D: ("Mi", 2),
-            Qt.Key_F: ("Fa", 2), Qt.Key_G: ("Sol", 2), Qt.Key_H: ("La", 2), Qt.Key_J: ("Si", 2),
-            Qt.Key_6: ("Do#", 2), Qt.Key_7: ("Ré#", 2),
-            Qt.Key_9: ("Fa#", 2), Qt.Key_0: ("Sol#", 2), Qt.Key_8: ("La#", 2),
-        }
-
-        # Use extended mapping only for piano
-        if self.current_instrument == "Piano":
-            key_map = piano_key_map
-        else:
-            key_map = {k: (v, 0) for k, v in base_key_map.items()}  # Default to octave 0
-
-        if key in key_map:
-            note, octave = key_map[key]
-
-            if note in note_to_frequency:
-                freq_data = note_to_frequency[note]
-                if isinstance(freq_data, tuple):
-                    frequency = freq_data[octave] if octave < len(freq_data) else freq_data[0]
-                else:
-                    frequency = freq_data
-
-                if self.current_instrument == "Piano":
-                    self.player.play_piano_tone(frequency, 0.5)
-                elif self.current_instrument == "Xylophone":
-                    self.player.play_xylophone_tone(frequency, 0.5)
-                elif self.current_instrument == "Video Game":
-                    frequency = freq_data[2] if isinstance(freq_data, tuple) else freq_data
-                    self.player.play_videoGame_tone(frequency, 0.2)
-
-                if self.recording:
-                    self.recorded_notes.append((note, 0.5))
+        entry = self.key_dispatch().get(key)
+        if entry is None or key in self.held_notes:
+            return super().keyPressEvent(event)
+
+        tracer.begin(self.current_instrument)
+        midi, instrument, frequency, duration = entry
+        tracer.mark("lookup")
+        self.held_notes[key] = (self.player.note_on(instrument, frequency, duration), midi)
+        self.recorder.note_on(midi)
+
+    def keyReleaseEvent(self, event):
+        if event.isAutoRepeat():
+            return
+        held = self.held_notes.pop(event.key(), None)
+        if held is None:
+            return super().keyReleaseEvent(event)
+        handle, midi = held
+        self.player.note_off(handle)
+        self.recorder.note_off(midi)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
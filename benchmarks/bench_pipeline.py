@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Per-note memory of the sample pipeline before and after the float32 rework.
+
+"before" is the float64 pipeline it replaced: a new array for every term of
+the harmonic recurrence, a normalized copy of the note, then np.vstack, a
+scale, astype(np.int16) and np.ascontiguousarray to reach stereo int16.
+"after" renders in float32 on a fixed set of buffers and writes the
+interleaved int16 frames into a reused buffer in one pass.
+
+Peak memory is what tracemalloc saw while one note went from synthesis to
+int16 frames; "copies" expresses it in multiples of the final stereo int16
+note, i.e. how many note-sized buffers were alive at the worst moment.
+
+    python benchmarks/bench_pipeline.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthesis
+from synthesis import PIANO_ADSR, PIANO_HARMONICS, PIANO_WEIGHTS
+
+SAMPLE_RATE = 44100
+DURATIONS = [0.083, 0.2, 0.5, 1.0]
+FREQUENCY = 440.0
+
+
+def legacy_piano(frequency, duration, sample_rate=SAMPLE_RATE):
+    t = synthesis.time_axis(duration, sample_rate)
+    theta = 2 * np.pi * np.multiply.outer([frequency], t)
+    dense = synthesis.dense_weights(PIANO_HARMONICS, PIANO_WEIGHTS)
+    current = np.sin(theta)
+    two_cos = 2 * np.cos(theta)
+    previous = np.zeros_like(current)
+    tone = dense[0] * current
+    for weight in dense[1:]:
+        previous, current = current, two_cos * current - previous
+        if weight:
+            tone += weight * current
+    tone = tone[0] * synthesis.create_envelope(len(t), *PIANO_ADSR)
+    return tone / np.max(np.abs(tone))
+
+
+def legacy_convert(tone):
+    stereo_tone = np.vstack((tone, tone)).T
+    return np.ascontiguousarray((32767 * stereo_tone).astype(np.int16))
+
+
+def legacy_note(duration):
+    return legacy_convert(legacy_piano(FREQUENCY, duration))
+
+
+def float32_note(duration, scratch):
+    tone = synthesis.render_note("piano", FREQUENCY, duration, SAMPLE_RATE)
+    return synthesis.pcm16(tone, 2, scratch)
+
+
+def measure(render, repeat):
+    render()  # Warm-up: envelopes, scratch buffers
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render()
+    elapsed = (time.perf_counter() - start) * 1000 / repeat
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(repeat=20):
+    scratch = np.empty((int(SAMPLE_RATE * max(DURATIONS)), 2), dtype=np.int16)
+    print(f"{'note':<10}{'':<8}{'ms/note':>10}{'peak KiB':>12}{'copies':>9}")
+    for duration in DURATIONS:
+        frames = int(SAMPLE_RATE * duration)
+        note_bytes = frames * 2 * np.dtype(np.int16).itemsize
+        for label, render in (("before", lambda: legacy_note(duration)),
+                              ("after", lambda: float32_note(duration, scratch))):
+            elapsed, peak = measure(render, repeat)
+            print(f"{duration:<10}{label:<8}{elapsed:>10.3f}{peak / 1024:>12.1f}{peak / note_bytes:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Batch rendering throughput: one process against a pool of worker processes.
+
+A set of generated scores is rendered to WAV files by render.render_files(),
+first in this process alone and then by pools of increasing size. Every run
+starts with empty tone caches (workers are fresh processes; the in-process
+cache is replaced), and each score has its own note lengths so that files do
+not just reuse each other's notes. The speedup is the single-process wall
+time over the pool's; it cannot exceed the number of cores.
+
+    python benchmarks/bench_render_pool.py
+    python benchmarks/bench_render_pool.py -n 16 -j 1 2 4 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import render
+
+NOTES = ["C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5", "D5", "E5"]
+
+
+def make_scores(directory, count, notes, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        # Note lengths unique to each score: no notes shared between files
+        lengths = [round(0.1 + 0.02 * index + 0.001 * k, 3) for k in range(20)]
+        path = os.path.join(directory, f"score{index:02d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for _ in range(notes):
+                f.write(f"{rng.choice(NOTES)} {rng.choice(lengths)}\n")
+        paths.append(path)
+    return paths
+
+
+def run(jobs, workers, instrument):
+    render._tone_cache = render.ToneCache()
+    start = time.perf_counter()
+    audio = 0.0
+    for _, _, length, _, _ in render.render_files(jobs, instrument, workers=workers):
+        audio += length
+    return time.perf_counter() - start, audio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare batch rendering in one process and in worker pools.")
+    parser.add_argument("-n", "--scores", type=int, default=8, help="scores to render per run")
+    parser.add_argument("--notes", type=int, default=1000, help="notes per score")
+    parser.add_argument("-j", "--workers", type=int, nargs="+", default=None,
+                        help="pool sizes to try (default: 2 and one per core)")
+    parser.add_argument("-i", "--instrument", default="piano")
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    pools = args.workers or sorted({2, cores})
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = [(path, os.path.splitext(path)[0] + ".wav")
+                for path in make_scores(directory, args.scores, args.notes)]
+        baseline, audio = run(jobs, 1, args.instrument)
+        print(f"{len(jobs)} scores, {audio:.1f} s of audio, {cores} core(s)")
+        print(f"  {'workers':>8}{'wall s':>10}{'files/s':>10}{'speedup':>10}")
+        print(f"  {1:>8}{baseline:>10.2f}{len(jobs) / baseline:>10.1f}{1.0:>10.2f}")
+        for workers in pools:
+            if workers == 1:
+                continue
+            elapsed, _ = run(jobs, workers, args.instrument)
+            print(f"  {workers:>8}{elapsed:>10.2f}{len(jobs) / elapsed:>10.1f}{baseline / elapsed:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Per-note cost of the xylophone before and after the resonator bank.
+
+"before" is the original play_xylophone_tone algorithm: the resonator is
+designed again for every note and the whole note is filtered and scanned
+for its peak before anything can be heard. "after" takes the design from a
+ResonatorBank, either for a whole note or streamed block by block through
+a ResonatorVoice, whose first block is ready long before the note ends.
+
+    python benchmarks/bench_xylophone.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.signal import lfilter, bilinear, lfilter_zi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthesis
+from engine import ResonatorVoice
+from synthesis import XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS
+
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 256
+# The 8 xylophone bars (Do to Do) at the durations used by the app and scores
+FREQUENCIES = [261.63, 293.66, 329.63, 349.23, 392.0, 440.0, 493.88, 523.25]
+DURATIONS = [0.083, 0.2, 0.5]
+
+
+def legacy_xylophone(frequency, duration, sample_rate=SAMPLE_RATE):
+    harmonics = XYLOPHONE_HARMONICS
+    harmonics_weights = XYLOPHONE_WEIGHTS
+    t = np.linspace(0, duration, int(sample_rate * duration), False)
+    tone = sum(weight * np.sin(frequency * harmonic * 2 * np.pi * t) for harmonic, weight in zip(harmonics, harmonics_weights))
+    tone *= (0.5 * np.pi)
+    b, a = bilinear([1, 0, 0], [1, -2 * 0.95 * np.cos(2 * np.pi * frequency / sample_rate), 0.9025], fs=sample_rate)
+    zi = lfilter_zi(b, a)
+    tone, _ = lfilter(b, a, tone, zi=zi * tone[0])
+    tone *= np.linspace(1, 0, len(tone))
+    return tone / np.max(np.abs(tone))
+
+
+def streamed_xylophone(frequency, duration, bank, sample_rate=SAMPLE_RATE):
+    voice = ResonatorVoice(frequency, duration, sample_rate, XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS, bank)
+    out = np.zeros(voice.length, dtype=np.float32)
+    block = np.zeros(BLOCK_SIZE, dtype=np.float32)
+    position = 0
+    while not voice.finished:
+        block.fill(0)
+        frames = voice.render(block)
+        out[position:position + frames] = block[:frames]
+        position += frames
+    return out
+
+
+def per_note_ms(render, repeat):
+    notes = [(f, d) for d in DURATIONS for f in FREQUENCIES]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frequency, duration in notes:
+            render(frequency, duration)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(notes))
+
+
+def legacy_design(frequency, sample_rate=SAMPLE_RATE):
+    b, a = bilinear([1, 0, 0], [1, -2 * 0.95 * np.cos(2 * np.pi * frequency / sample_rate), 0.9025], fs=sample_rate)
+    return b, a, lfilter_zi(b, a)
+
+
+def design_us(design, repeat):
+    # Cost of getting the resonator coefficients for one note
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frequency in FREQUENCIES:
+            design(frequency)
+    return (time.perf_counter() - start) * 1e6 / (repeat * len(FREQUENCIES))
+
+
+def first_block_ms(bank, repeat):
+    # Note-on to first audible block: the whole note before, one block after
+    block = np.zeros(BLOCK_SIZE, dtype=np.float32)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frequency in FREQUENCIES:
+            voice = ResonatorVoice(frequency, 0.5, SAMPLE_RATE, XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS, bank)
+            voice.render(block)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(FREQUENCIES))
+
+
+def main(repeat=5):
+    bank = synthesis.ResonatorBank(SAMPLE_RATE)
+    for frequency in FREQUENCIES:
+        bank.design(frequency)
+
+    rows = [
+        ("resonator design, before (us)", design_us(legacy_design, 20)),
+        ("resonator design, after (us)", design_us(bank.design, 20)),
+        ("whole note, before (ms/note)", per_note_ms(legacy_xylophone, repeat)),
+        ("whole note, after (ms/note)", per_note_ms(lambda f, d: synthesis.render_note("xylophone", f, d, SAMPLE_RATE), repeat)),
+        ("streamed note, after (ms/note)", per_note_ms(lambda f, d: streamed_xylophone(f, d, bank), repeat)),
+        ("0.5 s note to first block, before (ms)", per_note_ms(lambda f, d: legacy_xylophone(f, 0.5), repeat)),
+        ("0.5 s note to first block, after (ms)", first_block_ms(bank, repeat)),
+    ]
+    for label, value in rows:
+        print(f"{label:<42}{value:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
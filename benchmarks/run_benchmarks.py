@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark suite for the instruments.
+
+Runs with SDL's dummy audio driver and Qt's offscreen platform, so it needs
+neither a sound card nor a display. Results are written as JSON so runs can
+be compared across releases:
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --quick
+"""
+
+import os
+
+# Must be set before pygame / Qt are imported
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthesis
+from instrument import MusicPlayer
+from notes import note_table
+from render import render_score
+from score import compile_score
+
+APP_PATH = os.path.join(ROOT, "Digital Musical Instruments App.py")
+
+SCORES = ["mario.txt", "bella_ciao.txt"]
+DURATIONS = [0.083, 0.2, 0.5, 1.0]
+OCTAVES = [2, 3, 4, 5, 6, 7]
+
+
+def measure(fn, repeat):
+    """Median/min wall time (ms) and peak traced allocation (bytes) of fn()."""
+    fn()  # Warm-up: imports, first-call allocations
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "peak_bytes": peak,
+    }
+
+
+def bench_synthesis(player, repeat):
+    results = []
+    for instrument in synthesis.INSTRUMENTS:
+        wave = getattr(player, f"{instrument}_wave")
+        for octave in OCTAVES:
+            frequency = note_table.frequency(f"A{octave}")
+            for duration in DURATIONS:
+                result = measure(lambda: wave(frequency, duration), repeat)
+                result.update(instrument=instrument, note=f"A{octave}", frequency=frequency, duration=duration)
+                results.append(result)
+    return results
+
+
+def bench_conversion(player, repeat):
+    # _play_tone minus the playback itself: stereo int16 conversion and Sound creation
+    results = []
+    for duration in DURATIONS:
+        tone = player.piano_wave(440.0, duration)
+        result = measure(lambda: player._make_sound(tone), repeat)
+        result.update(duration=duration, samples=len(tone))
+        results.append(result)
+    return results
+
+
+def bench_scores(repeat):
+    results = []
+    for name in SCORES:
+        path = os.path.join(ROOT, name)
+        for instrument in synthesis.INSTRUMENTS:
+            compiled = compile_score(path, instrument, use_cache=False)
+            parse = measure(lambda: compile_score(path, instrument, use_cache=False), repeat)
+            render = measure(lambda: render_score(compiled, instrument), repeat)
+            results.append({
+                "score": name,
+                "instrument": instrument,
+                "notes": len(compiled),
+                "audio_seconds": compiled.length,
+                "compile": parse,
+                "render": render,
+                "notes_per_second": len(compiled) / (render["median_ms"] / 1000),
+                "realtime_factor": compiled.length / (render["median_ms"] / 1000),
+            })
+    return results
+
+
+def bench_ui(repeat):
+    """Time instrument and octave switches once every layout has been built."""
+    from PyQt5.QtWidgets import QApplication, QPushButton
+
+    spec = importlib.util.spec_from_file_location("instruments_app", APP_PATH)
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+    app = QApplication.instance() or QApplication([])
+
+    # Keep the app's own messages out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        window = app_module.InstrumentApp()
+    # Switch layouts directly: change_instrument() would also rewrite config.json
+    layouts = [("Piano", octaves) for octaves in (1, 2, 3)] + [("Xylophone", 2), ("Video Game", 2)]
+
+    def switch(instrument, octaves):
+        window.current_instrument, window.octaves = instrument, octaves
+        window.build_instrument_ui()
+
+    results = []
+    for instrument, octaves in layouts:
+        first = time.perf_counter()
+        switch(instrument, octaves)
+        first = (time.perf_counter() - first) * 1000
+        widgets = len(window.findChildren(QPushButton))
+        result = measure(lambda: switch(instrument, octaves), repeat)
+        result.update(
+            instrument=instrument, octaves=octaves, first_build_ms=first,
+            widgets_created=len(window.findChildren(QPushButton)) - widgets,
+        )
+        results.append(result)
+
+    window.sequencer.stop()
+    window.player.close()
+    window.hide()
+    return results
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def run(repeat=5):
+    player = MusicPlayer()
+    # Sounds can only be made once the mixer is open
+    player.open()
+    started = time.perf_counter()
+    results = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "sample_rate": player.sample_rate,
+            "repeat": repeat,
+        },
+        "synthesis": bench_synthesis(player, repeat),
+        "conversion": bench_conversion(player, repeat),
+        "scores": bench_scores(repeat),
+        "ui": bench_ui(repeat),
+    }
+    results["metadata"]["elapsed_s"] = time.perf_counter() - started
+    results["metadata"]["peak_rss_bytes"] = peak_rss_bytes()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the headless instrument benchmarks.")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="timed runs per measurement")
+    parser.add_argument("--quick", action="store_true", help="a single timed run per measurement")
+    args = parser.parse_args(argv)
+
+    results = run(1 if args.quick else args.repeat)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
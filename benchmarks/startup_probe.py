@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Headless cold-start probe for the instruments app.
+
+Every run starts a fresh interpreter (nothing is imported or cached yet) that
+imports the app, opens its window and plays one note, timing each step from
+the start of the process:
+
+    import        numpy, pygame, PyQt5 and the app's own modules
+    window        InstrumentApp() built and shown
+    audio_open    the audio device opened by the event loop
+    first_sound   a note played and its first block mixed (streaming engine)
+                  or queued on a mixer channel
+
+The slowest imports are listed from Python's -X importtime log, and the probe
+checks which heavy modules were already loaded when the window appeared.
+
+    python benchmarks/startup_probe.py
+    python benchmarks/startup_probe.py -n 5 -o startup.json
+"""
+
+import os
+
+# Must be set before pygame / Qt are imported
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "Digital Musical Instruments App.py")
+
+STAGES = ["import", "window", "audio_open", "first_sound"]
+
+CHILD_MARKER = "startup_probe: cold start"
+
+# Modules the start-up path should not need before the first note
+DEFERRED_MODULES = ["scipy.signal", "midi", "render"]
+
+
+def child():
+    """One cold start, reported as JSON on stdout."""
+    started = time.perf_counter()
+    marks = {}
+
+    def mark(stage):
+        marks[stage] = (time.perf_counter() - started) * 1000
+
+    # Imports traced before this line are the probe's own
+    print(CHILD_MARKER, file=sys.stderr, flush=True)
+    import contextlib
+    import importlib.util
+    sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location("instruments_app", APP_PATH)
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+    mark("import")
+
+    app = app_module.QApplication.instance() or app_module.QApplication([])
+    # Keep the app's own messages out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        window = app_module.InstrumentApp()
+    mark("window")
+    loaded = {name: name in sys.modules for name in DEFERRED_MODULES}
+
+    while not window.player.is_open:
+        app.processEvents()
+    mark("audio_open")
+
+    handle = window.player.play("piano", 440.0, 0.2, blocking=False)
+    if window.player.engine is not None:
+        while handle.position == 0:
+            time.sleep(0.0005)
+    mark("first_sound")
+
+    window.sequencer.stop()
+    window.player.close()
+    window.hide()
+    print(json.dumps({"marks_ms": marks, "loaded_at_window": loaded,
+                      "streaming": window.player.engine is not None}))
+
+
+def slowest_imports(log, count, children=3):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package",
+    # indented two spaces per level of nesting, each module listed after
+    # the ones it imported. Only the app's imports are kept, each with the
+    # slowest of the modules it imported directly.
+    imports = []
+    nested = []
+    lines = log.splitlines()
+    if CHILD_MARKER in lines:
+        lines = lines[lines.index(CHILD_MARKER) + 1:]
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entry = {"module": name.strip(), "cumulative_ms": int(cumulative) / 1000}
+        if depth == 1:
+            nested.append(entry)
+        elif depth == 0:
+            nested.sort(key=lambda child: child["cumulative_ms"], reverse=True)
+            entry["imports"] = nested[:children]
+            imports.append(entry)
+            nested = []
+    imports.sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+    return imports[:count]
+
+
+def run_once(importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += [os.path.abspath(__file__), "--child"]
+    # A scratch working directory, so no config.json changes the layout shown
+    with tempfile.TemporaryDirectory() as cwd:
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["process_ms"] = elapsed
+    report["stderr"] = result.stderr
+    return report
+
+
+def probe(runs=3, top=6):
+    reports = [run_once() for _ in range(runs)]
+    # Import tracing slows imports down, so it gets a run of its own
+    traced = run_once(importtime=True)
+
+    stages = {}
+    previous = [0.0] * runs
+    for stage in STAGES:
+        at = [report["marks_ms"][stage] for report in reports]
+        steps = [now - before for now, before in zip(at, previous)]
+        stages[stage] = {"at_ms": statistics.median(at), "step_ms": statistics.median(steps),
+                         "min_step_ms": min(steps), "max_step_ms": max(steps)}
+        previous = at
+    return {
+        "runs": runs,
+        "python": sys.version.split()[0],
+        "streaming": reports[0]["streaming"],
+        "stages": stages,
+        "process_ms": statistics.median(report["process_ms"] for report in reports),
+        "loaded_at_window": reports[0]["loaded_at_window"],
+        "slowest_imports": slowest_imports(traced["stderr"], top),
+    }
+
+
+def print_report(results):
+    print(f"Cold start, median of {results['runs']} runs "
+          f"({'streaming engine' if results['streaming'] else 'mixer channels'}):")
+    print(f"  {'stage':<14}{'step ms':>10}{'at ms':>10}")
+    for stage, times in results["stages"].items():
+        print(f"  {stage:<14}{times['step_ms']:>10.1f}{times['at_ms']:>10.1f}")
+    print(f"  {'process':<14}{'':>10}{results['process_ms']:>10.1f}  (including interpreter start and exit)")
+    print("Loaded when the window appeared:")
+    for name, loaded in results["loaded_at_window"].items():
+        print(f"  {name:<14}{'yes' if loaded else 'no'}")
+    print("Slowest imports (indented: the slowest modules each one imported):")
+    for entry in results["slowest_imports"]:
+        print(f"  {entry['module']:<32}{entry['cumulative_ms']:>8.1f} ms")
+        for child in entry["imports"]:
+            print(f"    {child['module']:<30}{child['cumulative_ms']:>8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the app's cold start, headless.")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="cold starts to take the median of")
+    parser.add_argument("-o", "--output", help="also write the results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child()
+        return 0
+    results = probe(args.runs)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Audio output capture.
+
+Whatever the player sends to the sound card is copied into a bounded queue
+and written to a WAV file by a background thread. The audio callback and the
+GUI thread only append to a deque (no lock, no disk access); once the queue
+is full, new buffers are dropped and counted rather than blocking playback.
+
+Two kinds of buffers are accepted: consecutive mixed blocks from the
+streaming engine (push_block), and whole notes started on mixer channels
+(push_note), which the writer mixes onto a timeline from their start times.
+"""
+
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+
+class AudioCapture:
+    """Streams the player's output to a WAV file from a writer thread."""
+
+    # Notes can still be added this far behind the current time
+    NOTE_MARGIN = 0.5
+
+    def __init__(self, path, sample_rate=44100, channels=2, max_pending=1024, poll_interval=0.05):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.dropped = 0
+        self.frames_written = 0
+        self._queue = deque()
+        self._stream_frames = 0
+        self._notes = False
+        self._origin = 0.0
+        self._pending = np.zeros(0, dtype=np.float32)  # Mixed but not yet written
+        self._horizon = 0  # Nothing will be added before this frame any more
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self._file = wave.open(self.path, "wb")
+        self._file.setnchannels(self.channels)
+        self._file.setsampwidth(2)
+        self._file.setframerate(self.sample_rate)
+        self._origin = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        horizon = self._drain()
+        self._write_until(max(horizon, self.frames_written + len(self._pending)))
+        self._file.close()
+        self._file = None
+
+    def push_block(self, block):
+        """Queue the next consecutive block of the mix (mono float)."""
+        offset = self._stream_frames
+        self._stream_frames += len(block)
+        self._enqueue(offset, np.array(block, dtype=np.float32), 1.0)
+
+    def push_note(self, samples, start=None, gain=1.0):
+        """Queue a whole note (mono float or int16 Sound samples) starting at `start`."""
+        if start is None:
+            start = time.monotonic()
+        self._notes = True
+        self._enqueue(int(round((start - self._origin) * self.sample_rate)), samples, gain)
+
+    def _enqueue(self, offset, samples, gain):
+        if len(self._queue) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._queue.append((offset, samples, gain))
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            horizon = self._drain()
+            if self._notes:
+                now = (time.monotonic() - self._origin - self.NOTE_MARGIN) * self.sample_rate
+                horizon = max(horizon, int(now))
+            self._write_until(horizon)
+
+    def _drain(self):
+        # Mix queued buffers into the pending timeline; returns the newest offset
+        horizon = self._horizon
+        while self._queue:
+            offset, samples, gain = self._queue.popleft()
+            horizon = max(horizon, offset)
+            if samples.dtype == np.int16:
+                samples = samples.reshape(len(samples), -1)[:, 0] * np.float32(gain / 32767)
+            elif gain != 1.0:
+                samples = samples * np.float32(gain)
+            if offset < self.frames_written:  # Arrived too late for its start
+                samples = samples[self.frames_written - offset:]
+                offset = self.frames_written
+            start = offset - self.frames_written
+            end = start + len(samples)
+            if end > len(self._pending):
+                self._pending = np.concatenate((self._pending, np.zeros(end - len(self._pending), np.float32)))
+            self._pending[start:end] += samples
+        return horizon
+
+    def _write_until(self, frame):
+        self._horizon = max(self._horizon, frame)
+        # Silence between notes is written one second at a time
+        while self.frames_written < frame:
+            count = min(frame - self.frames_written, self.sample_rate)
+            chunk = self._pending[:count]
+            if len(chunk) < count:
+                chunk = np.concatenate((chunk, np.zeros(count - len(chunk), np.float32)))
+            self._pending = self._pending[count:].copy()
+            pcm = (32767 * np.clip(chunk, -1, 1)).astype(np.int16)
+            if self.channels == 2:
+                pcm = np.repeat(pcm, 2)  # Entrelace gauche/droite
+            self._file.writeframes(pcm.tobytes())
+            self.frames_written += count
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Post-mix effects bus for the streaming engine.
+
+The effects run on the engine's mono mix, one block at a time, after every
+voice has been added in: their cost per block does not depend on how many
+notes are playing.
+
+The reverb convolves the mix with an impulse response using uniformly
+partitioned overlap-save: the response is cut into partitions of one block,
+each transformed once, and every block costs one FFT of two blocks, one
+inverse FFT and a multiply-add per partition in the frequency domain. The
+first partition is applied to the block it arrives in, so the reverb adds no
+latency. The impulse response is read from a local WAV file, or generated
+(decaying noise) when there is none.
+
+The delay is a circular buffer with feedback, processed a block at a time;
+its delay is never shorter than one block.
+"""
+
+import wave
+
+import numpy as np
+
+# Saved under the "effects" key of the app's configuration file
+DEFAULT_EFFECTS = {
+    "reverb": False, "impulse_response": None, "reverb_mix": 0.3,
+    "delay": False, "delay_seconds": 0.3, "delay_feedback": 0.35, "delay_mix": 0.3,
+}
+
+# Longer impulse responses are cut, which bounds the reverb's cost per block
+MAX_IR_SECONDS = 4.0
+
+# Reverberation time of the generated impulse response
+DEFAULT_IR_SECONDS = 1.6
+
+
+def default_impulse_response(sample_rate, seconds=DEFAULT_IR_SECONDS, seed=7):
+    """A synthetic room: noise decaying by 60 dB over `seconds`, duller as it fades."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    noise = rng.standard_normal(len(t))
+    # Early part bright, tail smoothed by a moving average
+    smooth = np.convolve(noise, np.ones(8) / 8, mode="same")
+    ir = (noise * np.exp(-t * 12) + smooth * (1 - np.exp(-t * 12))) * np.exp(-6.9 * t / seconds)
+    return ir.astype(np.float32)
+
+
+def load_impulse_response(path, sample_rate):
+    """Mono float32 impulse response from a PCM WAV file, at `sample_rate`."""
+    with wave.open(path, "rb") as f:
+        channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+        data = f.readframes(min(f.getnframes(), int(rate * MAX_IR_SECONDS)))
+    if width == 1:
+        samples = np.frombuffer(data, np.uint8).astype(np.float32) - 128
+    elif width == 2:
+        samples = np.frombuffer(data, "<i2").astype(np.float32)
+    elif width == 3:
+        # 24-bit samples: shift into the top of an int32
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 8).astype(np.float32)
+    elif width == 4:
+        samples = np.frombuffer(data, "<i4").astype(np.float32)
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate and len(samples):
+        # Linear interpolation is enough for a reverb tail
+        positions = np.arange(int(len(samples) * sample_rate / rate)) * (rate / sample_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+
+class ConvolutionReverb:
+    """Uniformly partitioned FFT convolution, one block per call."""
+
+    def __init__(self, impulse_response, block_size=256, mix=0.3):
+        ir = np.asarray(impulse_response, dtype=np.float64)
+        energy = np.sqrt(np.sum(ir ** 2))
+        # Unit energy: the wet signal is about as loud as the dry one
+        self.impulse_response = (ir / energy if energy else ir).astype(np.float32)
+        self.mix = mix
+        self.partition(block_size)
+
+    def partition(self, block_size):
+        """Cut the impulse response into blocks of `block_size`; clears the tail."""
+        self.block_size = block_size
+        count = max(1, -(-len(self.impulse_response) // block_size))
+        parts = np.zeros((count, block_size), dtype=np.float32)
+        parts.flat[:len(self.impulse_response)] = self.impulse_response
+        self._filters = np.fft.rfft(parts, 2 * block_size).astype(np.complex64)
+        # Spectra of the latest inputs, newest at _head
+        self._spectra = np.zeros_like(self._filters)
+        self._head = 0
+        self._input = np.zeros(2 * block_size, dtype=np.float32)
+
+    def process(self, block):
+        frames = len(block)
+        if frames != self.block_size:
+            self.partition(frames)
+        # Overlap-save: transform the previous block and this one together
+        self._input[:frames] = self._input[frames:]
+        self._input[frames:] = block
+        self._head = (self._head + 1) % len(self._spectra)
+        self._spectra[self._head] = np.fft.rfft(self._input)
+
+        # Partition p meets the input from p blocks ago: walk the ring backwards
+        head = self._head
+        spectrum = np.einsum("pk,pk->k", self._spectra[head::-1], self._filters[:head + 1])
+        if head + 1 < len(self._spectra):
+            spectrum += np.einsum("pk,pk->k", self._spectra[:head:-1], self._filters[head + 1:])
+        wet = np.fft.irfft(spectrum, 2 * frames)[frames:]
+        block += self.mix * wet
+
+
+class FeedbackDelay:
+    """Echoes from a circular buffer, each one `feedback` times the previous."""
+
+    def __init__(self, seconds, sample_rate=44100, feedback=0.35, mix=0.3):
+        self.feedback = feedback
+        self.mix = mix
+        self._buffer = np.zeros(max(1, int(seconds * sample_rate)), dtype=np.float32)
+        self._position = 0
+
+    def process(self, block):
+        frames = len(block)
+        if frames > len(self._buffer):
+            # The echo of a block must not land in that same block
+            self._buffer = np.zeros(frames, dtype=np.float32)
+            self._position = 0
+        index = (self._position + np.arange(frames)) % len(self._buffer)
+        delayed = self._buffer[index]
+        self._buffer[index] = block + self.feedback * delayed
+        block += self.mix * delayed
+        self._position = (self._position + frames) % len(self._buffer)
+
+
+class EffectsBus:
+    """The effects applied to every mixed block, in order."""
+
+    def __init__(self, effects=()):
+        self.effects = list(effects)
+
+    def __len__(self):
+        return len(self.effects)
+
+    def process(self, block):
+        for effect in self.effects:
+            effect.process(block)
+
+
+def build_bus(settings, sample_rate=44100, block_size=256):
+    """EffectsBus for the effects enabled in `settings` (see DEFAULT_EFFECTS); None if none are."""
+    settings = dict(DEFAULT_EFFECTS, **settings)
+    effects = []
+    if settings["reverb"]:
+        ir = None
+        if settings["impulse_response"]:
+            try:
+                ir = load_impulse_response(settings["impulse_response"], sample_rate)
+            except (OSError, EOFError, wave.Error, ValueError) as e:
+                print(f"Could not read impulse response {settings['impulse_response']}: {e}")
+        if ir is None or not len(ir):
+            ir = default_impulse_response(sample_rate)
+        effects.append(ConvolutionReverb(ir, block_size, settings["reverb_mix"]))
+    if settings["delay"]:
+        effects.append(FeedbackDelay(settings["delay_seconds"], sample_rate, settings["delay_feedback"],
+                                     settings["delay_mix"]))
+    return EffectsBus(effects) if effects else None
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Block-based streaming audio engine.
+
+Instead of rendering a whole note into its own Sound before it can start,
+every active note is a voice that renders itself one block at a time. The
+engine mixes all active voices into a single preallocated buffer each time
+the audio device asks for more samples, so a note starts at most one block
+after note_on() no matter how long it is. Post-mix effects (effects.py) run
+on that mix once per block.
+"""
+
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from synthesis import adsr_envelope, dense_weights, harmonic_sum
+from wavetable import Oscillator, square_wavetable, wavetable
+from latency import tracer
+
+
+@lru_cache(maxsize=None)
+def waveform_peak(harmonics, weights):
+    # The harmonics are integer multiples, so the waveform's peak does not
+    # depend on the frequency: one period is enough to normalize it
+    phase = np.linspace(0, 2 * np.pi, 2048, False)
+    return np.max(np.abs(np.sin(np.outer(phase, harmonics)) @ np.asarray(weights)))
+
+
+class Voice:
+    """A note that renders itself into consecutive blocks.
+
+    Two clocks advance as the voice renders: `clock` drives the oscillator
+    and only ever moves forward, while `position` walks through the written
+    note (envelope, decay). A held voice stops `position` at its sustain
+    point until release(), so a key can ring for as long as it is held.
+    """
+
+    # Fade applied when a voice is released before its natural end
+    RELEASE_SECONDS = 0.02
+
+    def __init__(self, frequency, duration, sample_rate):
+        self.frequency = frequency
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.length = int(sample_rate * duration)
+        self.position = 0
+        self.clock = 0
+        self.held = False
+        # Where a held note waits for its release; None if it cannot be held
+        self.sustain_point = self.length
+        self.release_samples = max(1, int(sample_rate * self.RELEASE_SECONDS))
+        self.fade = None  # Samples left in the release fade, once released
+        self.trace = None  # Latency trace, when instrumentation is enabled
+
+    @property
+    def finished(self):
+        return self.position >= self.length or (self.fade is not None and self.fade <= 0)
+
+    def release(self):
+        if (self.held and self.sustain_point is not None and self.sustain_point < self.length
+                and self.position >= self.sustain_point - 1):
+            # Held up to the sustain point: let the written release play out
+            self.held = False
+            return
+        if self.fade is None:
+            # Only a note held at its end fades past it, from its last sample
+            self.fade = self.release_samples if self.held else min(self.release_samples, self.length - self.position)
+        self.held = False
+
+    def render(self, out):
+        # Add this voice into `out` (mono float32) and advance; returns the
+        # number of frames actually written
+        if self.finished:
+            return 0
+        frames = len(out)
+        index = np.arange(self.position, self.position + frames)
+        sustained = None
+        if self.held and self.sustain_point is not None:
+            sustained = max(self.sustain_point - 1, self.position)
+            index = np.minimum(index, sustained)
+        elif self.fade is not None:
+            # A fade may run past the written note: its last sample is held meanwhile
+            index = np.minimum(index, self.length - 1)
+        else:
+            frames = min(frames, self.length - self.position)
+        if self.fade is not None:
+            frames = min(frames, self.fade)
+        index = index[:frames]
+
+        tone = self.samples(np.arange(self.clock, self.clock + frames), index)
+        if self.fade is not None:
+            tone = tone * ((self.fade - np.arange(frames)) / self.release_samples)
+            self.fade -= frames
+        out[:frames] += tone
+        self.clock += frames
+        self.position = int(index[-1]) + 1
+        if sustained is not None and self.position > sustained:
+            # Wait on the sustained sample until release(), short of the end
+            self.position = sustained
+        elif self.fade is not None and self.fade > 0:
+            self.position = min(self.position, self.length - 1)
+        return frames
+
+    def samples(self, clock, index):
+        # clock: oscillator sample numbers; index: positions in the written note
+        raise NotImplementedError
+
+
+class AdditiveVoice(Voice):
+    """Weighted sum of harmonics, with an optional ADSR envelope."""
+
+    def __init__(self, frequency, duration, sample_rate, harmonics, weights, adsr=None, decay=False):
+        super().__init__(frequency, duration, sample_rate)
+        self.step = 2 * np.pi * frequency / sample_rate
+        self.harmonics = np.asarray(harmonics, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        # Integer harmonics play from a band-limited wavetable
+        self.oscillator = None
+        if dense_weights(harmonics, weights) is not None:
+            self.oscillator = Oscillator(wavetable(tuple(harmonics), tuple(weights), sample_rate), frequency, sample_rate)
+        self.adsr = adsr
+        self.decay = decay
+        peak = waveform_peak(tuple(harmonics), tuple(weights))
+        self.gain = 1.0 / peak if peak else 0.0
+        if adsr is not None:
+            # Held notes stay at the sustain level, before the release segment
+            self.sustain_point = self.length - int(self.length * adsr[3])
+        elif decay:
+            self.sustain_point = None
+
+    def partial_sum(self, clock):
+        if self.oscillator is not None:
+            return self.oscillator.render(len(clock))
+        return harmonic_sum(self.step * clock, self.harmonics, self.weights)
+
+    def samples(self, clock, index):
+        tone = self.partial_sum(clock)
+        if self.adsr is not None:
+            tone *= adsr_envelope(index, self.length, *self.adsr)
+        if self.decay:
+            tone *= 1 - index / self.length
+        return tone * self.gain
+
+
+class ResonatorVoice(AdditiveVoice):
+    """Harmonics through a resonator whose state is carried across blocks."""
+
+    def __init__(self, frequency, duration, sample_rate, harmonics, weights, bank):
+        super().__init__(frequency, duration, sample_rate, harmonics, weights)
+        self.bank = bank
+        self.gain = bank.gain(frequency)
+        self.state = None
+        self.sustain_point = None  # Une lame frappée ne se tient pas
+
+    def samples(self, clock, index):
+        tone, self.state = self.bank.filter(self.partial_sum(clock) * (0.5 * np.pi), self.frequency, self.state)
+        # Même décroissance linéaire que np.linspace(1, 0, length)
+        tone *= 1 - index / max(self.length - 1, 1)
+        return tone * self.gain
+
+
+class SquareVoice(Voice):
+    """Band-limited square wave."""
+
+    def __init__(self, frequency, duration, sample_rate):
+        super().__init__(frequency, duration, sample_rate)
+        self.oscillator = Oscillator(square_wavetable(sample_rate), frequency, sample_rate)
+
+    def samples(self, clock, index):
+        return self.oscillator.render(len(clock))
+
+
+class BufferVoice(Voice):
+    """Streams a note that was rendered ahead of time.
+
+    `tone` may also be int16 samples, such as a sample bank's view of its
+    file, with a `gain` of 1 / 32767: each block is converted as it plays.
+    """
+
+    def __init__(self, tone, duration, sample_rate, gain=1.0):
+        super().__init__(0, duration, sample_rate)
+        self.tone = tone
+        self.gain = np.float32(gain)
+        self.length = len(tone)
+        self.sustain_point = None
+
+    def samples(self, clock, index):
+        if self.gain == 1:
+            return self.tone[index]
+        return self.tone[index] * self.gain
+
+
+class AudioEngine:
+    """Pull-model mixer feeding the audio device one block at a time."""
+
+    # Same voice stealing policies as the mixer's ChannelPool
+    STEAL_POLICIES = ("oldest", "quietest")
+
+    def __init__(self, sample_rate=44100, block_size=256, channels=2, max_voices=32, volume=0.05, steal="oldest"):
+        if steal not in self.STEAL_POLICIES:
+            raise ValueError(f"Unknown voice stealing policy: {steal}")
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.channels = channels
+        self.max_voices = max_voices
+        self.steal = steal
+        self.stolen = 0
+        self.volume = volume
+        self.device = None
+        self.blocks_rendered = 0
+        # Blocks the device had to wait for (see _callback)
+        self.underruns = 0
+        self._last_request = None
+        self.capture = None  # AudioCapture receiving every mixed block
+        self.effects = None  # EffectsBus applied to the mix (see effects.py)
+        self._voices = []
+        self._lock = threading.Lock()
+        self._mix = np.zeros(block_size, dtype=np.float32)
+
+    @property
+    def latency(self):
+        # Worst case delay between note_on() and the note reaching the device
+        return self.block_size / self.sample_rate
+
+    def note_on(self, voice):
+        with self._lock:
+            if len(self._voices) >= self.max_voices:
+                self._voices.pop(self._victim())
+                self.stolen += 1
+            self._voices.append(voice)
+        return voice
+
+    def note_off(self, voice):
+        # Released voices fade out (or finish their release) on their own
+        voice.release()
+
+    def stop_all(self):
+        with self._lock:
+            self._voices.clear()
+
+    def _victim(self):
+        # Index of the voice to steal; called with the lock held
+        if self.steal == "oldest":
+            return 0  # Vole la voix la plus ancienne
+
+        # As for mixer channels: our tones decay towards the end of the note,
+        # so the fraction still to play estimates how loud a voice is. A held
+        # note stays at full level until released
+        def level(index):
+            voice = self._voices[index]
+            remaining = 1.0 if voice.held else 1 - voice.position / voice.length if voice.length else 0.0
+            if voice.fade is not None:
+                remaining = min(remaining, voice.fade / voice.release_samples)
+            return remaining
+        return min(range(len(self._voices)), key=level)
+
+    def active_voices(self):
+        return len(self._voices)
+
+    def render_block(self, out):
+        # `out` is a (frames, channels) float32 array supplied by the device
+        frames = len(out)
+        if frames > len(self._mix):
+            self._mix = np.zeros(frames, dtype=np.float32)
+        mix = self._mix[:frames]
+        mix.fill(0)
+
+        with self._lock:
+            voices = list(self._voices)
+        for voice in voices:
+            if voice.trace is not None and voice.position == 0:
+                tracer.end(voice.trace, "audio")
+                voice.trace = None
+            voice.render(mix)
+
+        finished = [voice for voice in voices if voice.finished]
+        if finished:
+            with self._lock:
+                self._voices = [voice for voice in self._voices if not voice.finished]
+
+        # Replaced as a whole from other threads, so read it once per block
+        effects = self.effects
+        if effects is not None:
+            effects.process(mix)
+        np.multiply(mix[:, None], self.volume, out=out)
+        capture = self.capture
+        if capture is not None:
+            capture.push_block(out[:, 0])
+        self.blocks_rendered += 1
+
+    def start(self):
+        if self.device is not None:
+            return
+        try:
+            from pygame._sdl2 import sdl2, audio
+        except ImportError as e:
+            raise RuntimeError(f"SDL2 audio API unavailable: {e}")
+
+        try:
+            sdl2.init_subsystem(sdl2.INIT_AUDIO)
+            names = audio.get_audio_device_names(False)
+            self.device = audio.AudioDevice(
+                devicename=names[0] if names else "",
+                iscapture=False,
+                frequency=self.sample_rate,
+                audioformat=audio.AUDIO_F32,
+                numchannels=self.channels,
+                chunksize=self.block_size,
+                allowed_changes=0,
+                callback=self._callback,
+            )
+        except sdl2.error as e:
+            raise RuntimeError(f"Could not open audio device: {e}")
+        self.underruns = 0
+        self._last_request = None
+        self.device.pause(0)
+
+    def stop(self):
+        if self.device is not None:
+            self.device.pause(1)
+            self.device.close()
+            self.device = None
+
+    def _callback(self, device, memory):
+        requested = time.perf_counter()
+        out = np.asarray(memory).view(np.float32).reshape(-1, self.channels)
+        self.render_block(out)
+
+        # SDL asks for a block as the previous one starts playing. If this
+        # one is only ready two blocks' time after that request, the device
+        # ran dry in between and played silence: an underrun
+        if self._last_request is not None and time.perf_counter() - self._last_request > 2 * len(out) / self.sample_rate:
+            self.underruns += 1
+        self._last_request = requested
@@ -5,200 +5,461 @@ Created on Sat Apr 27 14:42:36 2024
 @author: laure
 """
 
+import threading
+import time
+from collections import OrderedDict
+
 import pygame
 import numpy as np
-from scipy.signal import lfilter, bilinear, lfilter_zi
-
-note_to_frequency = {
-    "Do" : (261,523,1046),
-    "Do#" : (277,554,1108),
-    "Ré" : (293,587,1174),
-    "Ré#" : (311,622,1244),
-    "Mi" : (329,659,1318),
-    "Fa" : (349,698,1396),
-    "Fa#" : (369,739,1479),
-    "Sol" : (392,783,1568),
-    "Sol#" : (415,830,1661),
-    "La" : (440,880,1760),
-    "La#" : (477,932,1864),
-    "Si" : (496,987,1975),
-    "B0": 31,
-    "C1": 33,
-    "C#1": 35,  # or "Db1": 35
-    "D1": 37,
-    "D#1": 39,  # or "Eb1": 39
-    "E1": 41,
-    "F1": 44,
-    "F#1": 46,  # or "Gb1": 46
-    "G1": 49,
-    "G#1": 52,  # or "Ab1": 52
-    "A1": 55,
-    "A#1": 58,  # or "Bb1": 58
-    "B1": 62,
-    "C2": 65,
-    "C#2": 69,  # or "Db2": 69
-    "D2": 73,
-    "D#2": 78,  # or "Eb2": 78
-    "E2": 82,
-    "F2": 87,
-    "F#2": 93,  # or "Gb2": 93
-    "G2": 98,
-    "G#2": 104,  # or "Ab2": 104
-    "A2": 110,
-    "A#2": 117,  # or "Bb2": 117
-    "B2": 123,
-    "C3": 131,
-    "C#3": 139,  # or "Db3": 139
-    "D3": 147,
-    "D#3": 156,  # or "Eb3": 156
-    "E3": 165,
-    "F3": 175,
-    "F#3": 185,  # or "Gb3": 185
-    "G3": 196,
-    "G#3": 208,  # or "Ab3": 208
-    "A3": 220,
-    "A#3": 233,  # or "Bb3": 233
-    "B3": 247,
-    "C4": 262,
-    "C#4": 277,  # or "Db4": 277
-    "D4": 294,
-    "D#4": 311,  # or "Eb4": 311
-    "E4": 330,
-    "F4": 349,
-    "F#4": 370,  # or "Gb4": 370
-    "G4": 392,
-    "G#4": 415,  # or "Ab4": 415
-    "A4": 440,
-    "A#4": 466,  # or "Bb4": 466
-    "B4": 494,
-    "C5": 523,
-    "C#5": 554,  # or "Db5": 554
-    "D5": 587,
-    "D#5": 622,  # or "Eb5": 622
-    "E5": 659,
-    "F5": 698,
-    "F#5": 740,  # or "Gb5": 740
-    "G5": 784,
-    "G#5": 831,  # or "Ab5": 831
-    "A5": 880,
-    "A#5": 932,  # or "Bb5": 932
-    "B5": 988,
-    "C6": 1047,
-    "C#6": 1109,  # or "Db6": 1109
-    "D6": 1175,
-    "D#6": 1245,  # or "Eb6": 1245
-    "E6": 1319,
-    "F6": 1397,
-    "F#6": 1480,  # or "Gb6": 1480
-    "G6": 1568,
-    "G#6": 1661,  # or "Ab6": 1661
-    "A6": 1760,
-    "A#6": 1865,  # or "Bb6": 1865
-    "B6": 1976,
-    "C7": 2093,
-    "C#7": 2217,  # or "Db7": 2217
-    "D7": 2349,
-    "D#7": 2489,  # or "Eb7": 2489
-    "E7": 2637,
-    "F7": 2794,
-    "F#7": 2960,  # or "Gb7": 2960
-    "G7": 3136,
-    "G#7": 3322,  # or "Ab7": 3322
-    "A7": 3520,
-    "A#7": 3729,  # or "Bb7": 3729
-    "B7": 3951,
-    "C8": 4186,
-    "C#8": 4435,  # or "Db8": 4435
-    "D8": 4699,
-    "D#8": 4978,  # or "Eb8": 4978
-}
-    
-    
+
+import synthesis
+from synthesis import PIANO_HARMONICS, PIANO_WEIGHTS, PIANO_ADSR, XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS
+from capture import AudioCapture
+from effects import build_bus
+from engine import AudioEngine, AdditiveVoice, BufferVoice, ResonatorVoice, SquareVoice
+from latency import tracer
+
+
+class SoundCache:
+    """Bounded LRU cache of rendered notes, evicted against a memory budget."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Notes are rendered from the GUI thread and the sequencer thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, sound, samples):
+        # Un son plus gros que tout le budget n'est jamais mis en cache
+        if samples.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1].nbytes
+            self._entries[key] = (sound, samples)
+            self.current_bytes += samples.nbytes
+
+            # Evict least recently used notes until we fit the budget again
+            while self.current_bytes > self.max_bytes:
+                _, (_, old_samples) = self._entries.popitem(last=False)
+                self.current_bytes -= old_samples.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ChannelPool:
+    """Fixed set of mixer channels with a polyphony limit and voice stealing."""
+
+    STEAL_POLICIES = ("oldest", "quietest")
+
+    def __init__(self, polyphony=16, steal="oldest"):
+        if steal not in self.STEAL_POLICIES:
+            raise ValueError(f"Unknown voice stealing policy: {steal}")
+        pygame.mixer.set_num_channels(polyphony)
+        self.polyphony = polyphony
+        self.steal = steal
+        self.channels = [pygame.mixer.Channel(i) for i in range(polyphony)]
+        self._started = [0.0] * polyphony
+        self._durations = [0.0] * polyphony
+        self._volumes = [0.0] * polyphony
+        self.stolen = 0
+        self._lock = threading.Lock()
+
+    def play(self, sound, duration):
+        # Returns the channel index; started(voice) tells a later note-off
+        # whether the channel still plays that same note
+        with self._lock:
+            now = time.monotonic()
+            voice = self._free_channel(now)
+            channel = self.channels[voice]
+            if channel.get_busy():
+                channel.stop()
+                self.stolen += 1
+            channel.play(sound)
+            self._started[voice] = now
+            self._durations[voice] = duration
+            self._volumes[voice] = sound.get_volume()
+        return voice
+
+    def started(self, voice):
+        return self._started[voice]
+
+    def stop(self, voice, fade_ms=0, started=None):
+        if started is not None and self._started[voice] != started:
+            return  # The channel was stolen for another note meanwhile
+        channel = self.channels[voice]
+        if fade_ms:
+            channel.fadeout(fade_ms)
+        else:
+            channel.stop()
+
+    def stop_all(self):
+        for channel in self.channels:
+            channel.stop()
+
+    def active_voices(self):
+        return sum(1 for channel in self.channels if channel.get_busy())
+
+    def _free_channel(self, now):
+        for voice, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return voice
+
+        if self.steal == "oldest":
+            return min(range(self.polyphony), key=self._started.__getitem__)
+
+        # All our tones decay towards the end of the note, so the remaining
+        # fraction of the note is a good estimate of how loud it still is
+        def level(voice):
+            elapsed = now - self._started[voice]
+            remaining = 1 - elapsed / self._durations[voice] if self._durations[voice] else 0
+            return self._volumes[voice] * max(0.0, remaining)
+        return min(range(self.polyphony), key=level)
 
 
 class MusicPlayer:
     
-    def __init__(self, sample_rate=44100): 
-        pygame.mixer.init(frequency=44100, size=-16, channels=2)
+    def __init__(self, sample_rate=44100, cache_bytes=32 * 1024 * 1024, polyphony=16, steal="oldest", blocking=True,
+                 streaming=False, block_size=256, bank=None, output_channels=2): 
         self.sample_rate = sample_rate
-        
+        self.cache = SoundCache(cache_bytes)
+        # Optional SampleBank: rendered notes persist across sessions and processes
+        self.bank = bank
+        # When False, play_*_tone returns as soon as the note has started
+        self.blocking = blocking
+
+        # Streaming mode renders every note block by block into one shared
+        # mix; otherwise each note is a Sound on its own mixer channel. The
+        # audio device is only opened by the first note (see open())
+        self.engine = None
+        self.channels = None
+        self.capture = None
+        self.streaming = streaming
+        self.polyphony = polyphony
+        self.steal = steal
+        # Device settings: block_size is the device buffer, in frames, for
+        # the streaming engine and the mixer alike (see configure())
+        self.block_size = block_size
+        self.output_channels = output_channels
+        # Post-mix effects settings (see effects.DEFAULT_EFFECTS); streaming only
+        self.effect_settings = {}
+        self._opened = False
+        self._open_lock = threading.Lock()
+        # Per-thread int16 scratch buffer for _make_sound (GUI and sequencer threads)
+        self._scratch = threading.local()
+
+    @property
+    def is_open(self):
+        return self._opened
+
+    def open(self):
+        """Open the audio device, once; every method that plays calls this first."""
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            if self.streaming:
+                engine = AudioEngine(self.sample_rate, self.block_size, self.output_channels, max_voices=self.polyphony,
+                                     steal=self.steal)
+                engine.effects = build_bus(self.effect_settings, self.sample_rate, self.block_size)
+                try:
+                    engine.start()
+                    self.engine = engine
+                except RuntimeError as e:
+                    print(f"Streaming engine unavailable, using mixer channels: {e}")
+            if self.engine is None:
+                pygame.mixer.init(frequency=self.sample_rate, size=-16, channels=self.output_channels,
+                                  buffer=self.block_size)
+                self.channels = ChannelPool(self.polyphony, self.steal)
+            self._opened = True
+
+    def configure(self, sample_rate=None, block_size=None, output_channels=None):
+        """Change the device settings; the device is closed and reopens with the next note."""
+        with self._open_lock:
+            if self._opened:
+                self.stop_capture()
+                if self.engine is not None:
+                    self.engine.stop()
+                else:
+                    pygame.mixer.quit()
+                    # Sounds belong to the mixer they were made for
+                    self.cache.clear()
+                self.engine = None
+                self.channels = None
+                self._opened = False
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if block_size is not None:
+                self.block_size = block_size
+            if output_channels is not None:
+                self.output_channels = output_channels
+
+    def set_effects(self, settings):
+        """Apply post-mix effects from now on, even while notes play; False without the streaming engine."""
+        self.effect_settings = dict(settings)
+        if self.engine is None:
+            # Built when the device opens, if the streaming engine does
+            return self.streaming and not self._opened
+        # The new bus starts silent: the old one's tail is cut off
+        self.engine.effects = build_bus(self.effect_settings, self.sample_rate, self.block_size)
+        return True
+
+    @property
+    def latency(self):
+        # Delay added by the device buffer alone, in seconds
+        return self.block_size / self.sample_rate
+
+    def play_xylophone_tone(self, frequency, duration, blocking=None, hold=False):
+        self.open()
+        if self.engine is not None:
+            return self._play_voice(self._stream_voice("xylophone", frequency, duration, hold), blocking, hold)
+        return self._play_cached("xylophone", frequency, duration, self.xylophone_wave, blocking)
+
+    def play_piano_tone(self, frequency, duration, blocking=None, hold=False):
+        self.open()
+        if self.engine is not None:
+            return self._play_voice(self._stream_voice("piano", frequency, duration, hold), blocking, hold)
+        return self._play_cached("piano", frequency, duration, self.piano_wave, blocking)
+
+    def play_videoGame_tone(self, frequency, duration, blocking=None, hold=False):
+        self.open()
+        if self.engine is not None:
+            return self._play_voice(self._stream_voice("videogame", frequency, duration, hold), blocking, hold)
+        return self._play_cached("videogame", frequency, duration, self.videogame_wave, blocking)
+
+    def play(self, instrument, frequency, duration, blocking=None, hold=False):
+        """Play a note by instrument name ("piano", "xylophone" or "videogame")."""
+        if instrument == "piano":
+            return self.play_piano_tone(frequency, duration, blocking, hold)
+        if instrument == "xylophone":
+            return self.play_xylophone_tone(frequency, duration, blocking, hold)
+        if instrument == "videogame":
+            return self.play_videoGame_tone(frequency, duration, blocking, hold)
+        raise ValueError(f"Unknown instrument: {instrument}")
+
+    def play_buffer(self, tone, blocking=None):
+        """Play an already rendered tone, such as a passage mixed ahead of time."""
+        self.open()
+        duration = len(tone) / self.sample_rate
+        if self.engine is not None:
+            return self._play_voice(BufferVoice(tone, duration, self.sample_rate), blocking)
+        # Overlapping notes add up past full scale: clip rather than wrap around in int16
+        return self._play_tone(np.clip(tone, -1, 1), duration, blocking)
+
+    def note_on(self, instrument, frequency, duration):
+        """Start a note that lasts until note_off(); returns its handle.
 
-    def play_xylophone_tone(self, frequency, duration):
-        # Génération des harmoniques complexes pour un son métallique
-        harmonics = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-        harmonics_weights = [0.5, 0.4, 0.35, 0.3, 0.25, 0.2, 0.15, 0.1, 0.05, 0.03, 0.02, 0.01]
+        Streamed voices sustain while held. Mixer channels can only play the
+        rendered note, so there note_off() just cuts it short.
+        """
+        voice = self.play(instrument, frequency, duration, blocking=False, hold=True)
+        if self.engine is not None:
+            return voice
+        return voice, self.channels.started(voice)
 
-        # Generate the tone
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = sum(weight * np.sin(frequency * harmonic * 2 * np.pi * t) for harmonic, weight in zip(harmonics, harmonics_weights))
-        tone *= (0.5 * np.pi)
+    def note_off(self, handle, fade_ms=20):
+        if self.engine is not None:
+            self.engine.note_off(handle)
+        else:
+            voice, started = handle
+            self.channels.stop(voice, fade_ms, started)
 
-        # Appliquer un filtre de résonance pour simuler la sonorité métallique
-        b, a = bilinear([1, 0, 0], [1, -2 * 0.95 * np.cos(2 * np.pi * frequency / self.sample_rate), 0.9025], fs=self.sample_rate)
-        zi = lfilter_zi(b, a)
-        tone, _ = lfilter(b, a, tone, zi=zi*tone[0])
+    def prepare(self, instrument, frequency, duration):
+        """Render a note into the cache ahead of time, without playing it.
 
-        # Apply a quick decay envelope
-        envelope = np.linspace(1, 0, len(tone))
-        tone *= envelope
+        Safe to call from any thread while notes are playing.
+        """
+        wave = getattr(self, f"{instrument}_wave")
+        self.open()
+        if self.engine is not None:
+            if self.bank is not None:
+                # Streamed from the bank once it is there (see _stream_voice)
+                key = self._cache_key(instrument, frequency, duration)
+                if self.bank.get(key) is None:
+                    self.bank.put(key, synthesis.pcm16(wave(frequency, duration), 1))
+            # Other voices render themselves while streaming; rendering one
+            # block of a throwaway voice builds what they share (wavetables,
+            # the resonator design) so the real note starts without it
+            self._make_voice(instrument, frequency, duration).render(np.zeros(self.engine.block_size, np.float32))
+            return
+        key = self._cache_key(instrument, frequency, duration)
+        if key not in self.cache:
+            self.cache.put(key, *self._render_sound(key, wave, frequency, duration))
 
-        # Normalisation du ton
-        tone = tone / np.max(np.abs(tone))
+    def stop_all(self):
+        if self.engine is not None:
+            self.engine.stop_all()
+        elif self.channels is not None:
+            self.channels.stop_all()
 
-        # Jouer le son
-        self._play_tone(tone, duration)
+    def start_capture(self, path):
+        """Write everything played from now on to a WAV file."""
+        self.stop_capture()
+        self.open()
+        capture = AudioCapture(path, self.sample_rate, channels=self.output_channels)
+        capture.start()
+        self.capture = capture
+        if self.engine is not None:
+            self.engine.capture = capture
 
-        
-        
-    def play_piano_tone(self, frequency, duration):
-        # Create harmonics
-        harmonics = [1, 2, 3, 4, 5, 6, 7, 8]
-        harmonics_weights = [0.5, 0.25, 0.1, 0.05, 0.025, 0.0125, 0.00625, 0.003125]
+    def stop_capture(self):
+        capture = self.capture
+        if capture is None:
+            return None
+        if self.engine is not None:
+            self.engine.capture = None
+        self.capture = None
+        capture.stop()
+        return capture
 
-        # Generate tone
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = sum(weight * np.sin(frequency * harmonic * 2 * np.pi * t) for harmonic, weight in zip(harmonics, harmonics_weights))
+    def close(self):
+        self.stop_capture()
+        if self.engine is not None:
+            self.engine.stop()
 
-        # Ensure the envelope matches the length of the tone array
-        envelope = self.create_envelope(len(tone), attack_percent=0.01, decay_percent=0.1, sustain_level=0.3, release_percent=0.1)
+    def xylophone_wave(self, frequency, duration):
+        return synthesis.render_note("xylophone", frequency, duration, self.sample_rate)
 
-        # Apply envelope to the tone
-        tone *= envelope
-        tone = tone / np.max(np.abs(tone))  # Normalization
+    def piano_wave(self, frequency, duration):
+        return synthesis.render_note("piano", frequency, duration, self.sample_rate)
 
-        # Play tone
-        self._play_tone(tone, duration)
+    def videogame_wave(self, frequency, duration):
+        return synthesis.render_note("videogame", frequency, duration, self.sample_rate)
 
     def create_envelope(self, num_samples, attack_percent, decay_percent, sustain_level, release_percent):
-        # Calculate lengths of each part of the ADSR envelope
-        attack_samples = int(num_samples * attack_percent)
-        decay_samples = int(num_samples * decay_percent)
-        sustain_samples = num_samples - (attack_samples + decay_samples + int(num_samples * release_percent))
-        release_samples = num_samples - (attack_samples + decay_samples + sustain_samples)
-
-        # Generate ADSR envelope
-        attack = np.linspace(0, 1, attack_samples, False)
-        decay = np.linspace(1, sustain_level, decay_samples, False)
-        sustain = np.full(sustain_samples, sustain_level)
-        release = np.linspace(sustain_level, 0, release_samples, False)
-        envelope = np.concatenate((attack, decay, sustain, release))
-        
-        # Ensure the envelope is not longer than the number of samples
-        return envelope[:num_samples]
-
-    def play_videoGame_tone(self, frequency, duration):
-        # Onde carrée pour la guitare
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = np.sign(np.sin(frequency * 2 * np.pi * t))
-        self._play_tone(tone, duration)
-
-    def _play_tone(self, tone, duration):
-        stereo_tone = np.vstack((tone, tone)).T
-        contiguous_tone = np.ascontiguousarray((32767 * stereo_tone).astype(np.int16))
-        sound = pygame.sndarray.make_sound(contiguous_tone)
+        return synthesis.create_envelope(num_samples, attack_percent, decay_percent, sustain_level, release_percent)
+
+    def render_batch(self, instrument, notes):
+        """Render many (frequency, duration) pairs in one call, without playing them."""
+        return synthesis.render_batch(instrument, notes, self.sample_rate)
+
+    def _cache_key(self, instrument, frequency, duration):
+        return (instrument, round(float(frequency), 3), round(float(duration), 4), self.sample_rate)
+
+    def _play_cached(self, instrument, frequency, duration, wave, blocking=None):
+        key = self._cache_key(instrument, frequency, duration)
+        entry = self.cache.get(key)
+        tracer.mark("cache")
+        if entry is None:
+            entry = self._render_sound(key, wave, frequency, duration)
+            self.cache.put(key, *entry)
+        sound, _ = entry
+        return self._start_sound(sound, duration, blocking)
+
+    def _stream_voice(self, instrument, frequency, duration, hold=False):
+        # A note already in the sample bank streams from the bank's view of
+        # its file. Held notes are synthesized, since a rendered note cannot
+        # sustain: except on the xylophone, whose struck bars never do
+        if self.bank is not None and (not hold or instrument == "xylophone"):
+            samples = self.bank.get(self._cache_key(instrument, frequency, duration))
+            if samples is not None:
+                tracer.mark("bank")
+                return BufferVoice(samples, duration, self.sample_rate, gain=1 / 32767)
+        return self._make_voice(instrument, frequency, duration)
+
+    def _make_voice(self, instrument, frequency, duration):
+        if instrument == "piano":
+            return AdditiveVoice(frequency, duration, self.sample_rate, PIANO_HARMONICS, PIANO_WEIGHTS, adsr=PIANO_ADSR)
+        if instrument == "xylophone":
+            return ResonatorVoice(frequency, duration, self.sample_rate, XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS,
+                                  synthesis.resonator_bank(self.sample_rate))
+        return SquareVoice(frequency, duration, self.sample_rate)
+
+    def _play_voice(self, voice, blocking=None, hold=False):
+        voice.held = hold
+        tracer.mark("voice")
+        # The trace is closed by the engine when the voice's first block is mixed
+        voice.trace = tracer.detach()
+        self.engine.note_on(voice)
+        if self.blocking if blocking is None else blocking:
+            pygame.time.delay(int(voice.duration * 1000))
+        return voice
+
+    def _pcm_buffer(self, frames):
+        buffer = getattr(self._scratch, "pcm", None)
+        if buffer is None or len(buffer) < frames or buffer.shape[1] != self.output_channels:
+            buffer = self._scratch.pcm = np.empty((frames, self.output_channels), dtype=np.int16)
+        return buffer
+
+    def _render_sound(self, key, wave, frequency, duration):
+        # A note missing from the cache: read from the sample bank if it has
+        # it, otherwise synthesized and added to the bank
+        samples = self.bank.get(key) if self.bank is not None else None
+        if samples is not None:
+            tracer.mark("bank")
+            pcm = self._pcm_buffer(len(samples))[:len(samples)]
+            pcm[:] = samples[:, None]
+            tracer.mark("conversion")
+            return self._sound_from_pcm(pcm)
+        tone = wave(frequency, duration)
+        tracer.mark("synthesis")
+        entry = self._make_sound(tone)
+        if self.bank is not None:
+            samples = entry[1]
+            self.bank.put(key, samples.reshape(len(samples), -1)[:, 0])
+        return entry
+
+    def _make_sound(self, tone):
+        # Interleaved int16 in one pass into a reused buffer; the Sound copies it
+        pcm = synthesis.pcm16(tone, self.output_channels, self._pcm_buffer(len(tone)))
+        tracer.mark("conversion")
+        return self._sound_from_pcm(pcm)
+
+    def _sound_from_pcm(self, pcm):
+        if self.output_channels == 1:
+            pcm = pcm[:, 0]  # A mono mixer takes one-dimensional arrays
+        sound = pygame.sndarray.make_sound(pcm)
         sound.set_volume(0.05)  # Réglez le volume
-        sound.play()
-        pygame.time.delay(int(duration * 1000))
-        
-        
-    
\ No newline at end of file
+        tracer.mark("make_sound")
+        # The int16 view shares the Sound's own buffer, so caching it costs nothing extra
+        return sound, pygame.sndarray.samples(sound)
+
+    def _start_sound(self, sound, duration, blocking=None):
+        voice = self.channels.play(sound, duration)
+        if self.capture is not None:
+            # The Sound's own int16 buffer, converted by the capture thread
+            self.capture.push_note(pygame.sndarray.samples(sound), gain=sound.get_volume())
+        # SDL gives no callback when a channel starts: queueing is the last step we see
+        tracer.end(stage="queued")
+        if self.blocking if blocking is None else blocking:
+            pygame.time.delay(int(duration * 1000))
+        return voice
+
+    def _play_tone(self, tone, duration, blocking=None):
+        self.open()
+        sound, _ = self._make_sound(tone)
+        return self._start_sound(sound, duration, blocking)
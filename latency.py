@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in note latency instrumentation.
+
+A trace follows one note from the Qt input handler to the moment its audio
+starts: begin() opens it, each stage of InstrumentApp / MusicPlayer calls
+mark(), and end() files the time spent in every stage into per-instrument
+histograms. While disabled, begin() returns immediately and mark() is a
+single attribute check, so the instrumentation costs next to nothing.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Samples kept per (instrument, stage) histogram
+HISTORY = 4096
+
+PERCENTILES = (50, 95, 99)
+
+
+class Trace:
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.stamps = [("input", time.perf_counter())]
+
+    def mark(self, stage):
+        self.stamps.append((stage, time.perf_counter()))
+
+
+class LatencyTracer:
+    """Collects note traces into per-instrument latency histograms."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def begin(self, instrument):
+        if not self.enabled:
+            return
+        self._local.trace = Trace(instrument)
+
+    def mark(self, stage):
+        if not self.enabled:
+            return
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.mark(stage)
+
+    def detach(self):
+        """Hand the current trace over to another thread (e.g. an audio voice)."""
+        if not self.enabled:
+            return None
+        trace = getattr(self._local, "trace", None)
+        self._local.trace = None
+        return trace
+
+    def end(self, trace=None, stage=None):
+        if trace is None:
+            if not self.enabled:
+                return
+            trace = self.detach()
+            if trace is None:
+                return
+        if stage is not None:
+            trace.mark(stage)
+
+        with self._lock:
+            previous = trace.stamps[0][1]
+            for name, stamp in trace.stamps[1:]:
+                self._history(trace.instrument, name).append(stamp - previous)
+                previous = stamp
+            self._history(trace.instrument, "total").append(previous - trace.stamps[0][1])
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """{instrument: {stage: {count, p50_ms, p95_ms, p99_ms}}}"""
+        with self._lock:
+            snapshot = {key: np.array(values) for key, values in self._samples.items()}
+        summary = {}
+        for (instrument, stage), values in snapshot.items():
+            if not len(values):
+                continue
+            stats = {"count": len(values)}
+            for p, value in zip(PERCENTILES, np.percentile(values * 1000, PERCENTILES)):
+                stats[f"p{p}_ms"] = float(value)
+            summary.setdefault(instrument, {})[stage] = stats
+        return summary
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def _history(self, instrument, stage):
+        key = (instrument, stage)
+        if key not in self._samples:
+            self._samples[key] = deque(maxlen=HISTORY)
+        return self._samples[key]
+
+
+tracer = LatencyTracer()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Low-latency audio device settings.
+
+The audio device is described by three settings: sample rate, buffer size
+(frames per block) and channel count. The buffer size sets the latency
+floor, since a note can only reach the speakers once the block being played
+is over, but a buffer too small for the machine makes the device starve.
+
+autotune() finds the smallest buffer this machine sustains: it runs the
+streaming engine under a load of silent voices at decreasing buffer sizes
+until underruns appear, then backs off to the last size that had none. Each
+step also measures the output latency of test notes, from note_on() until
+the block that carries them has been played.
+
+    python lowlatency.py                 # report for the saved settings
+    python lowlatency.py --autotune --save
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from engine import AdditiveVoice, AudioEngine
+from synthesis import PIANO_ADSR, PIANO_HARMONICS, PIANO_WEIGHTS
+
+# Saved under the "audio" key of the app's configuration file
+CONFIG_FILE = "config.json"
+DEFAULT_SETTINGS = {"sample_rate": 44100, "buffer_size": 256, "channels": 2}
+
+SAMPLE_RATES = (22050, 44100, 48000)
+BUFFER_SIZES = (4096, 2048, 1024, 512, 256, 128, 64, 32)
+
+
+def load_settings(path=CONFIG_FILE):
+    """Device settings saved in the configuration file, defaults for the rest."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, "r") as f:
+            settings.update(json.load(f).get("audio", {}))
+    except (OSError, ValueError):
+        pass
+    return settings
+
+
+def save_settings(settings, path=CONFIG_FILE):
+    """Store the device settings, keeping the rest of the configuration file."""
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    config["audio"] = {name: settings[name] for name in DEFAULT_SETTINGS}
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+
+def _silent_voice(frequency, duration, sample_rate):
+    # Costs as much to render as a piano note, but adds nothing to the mix
+    voice = AdditiveVoice(frequency, duration, sample_rate, PIANO_HARMONICS, PIANO_WEIGHTS, adsr=PIANO_ADSR)
+    voice.gain = 0.0
+    return voice
+
+
+def measure(engine, seconds=0.5, load=8, interval=0.02):
+    """Underruns and output latency of a running engine, under `load` sustained voices.
+
+    Returns {"underruns", "notes", "median_ms", "p95_ms", "max_ms"}; latencies
+    run from note_on() to the end of the first block carrying the note.
+    """
+    sample_rate = engine.sample_rate
+    block = engine.block_size / sample_rate
+    background = [_silent_voice(110 * 2 ** (i / 12), seconds + 1, sample_rate) for i in range(load)]
+    for voice in background:
+        voice.held = True
+        engine.note_on(voice)
+    time.sleep(max(4 * block, 0.05))  # Let the device settle first
+
+    underruns = engine.underruns
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        voice = _silent_voice(880, 0.05, sample_rate)
+        start = time.perf_counter()
+        engine.note_on(voice)
+        while voice.position == 0 and time.perf_counter() < end + 1:
+            time.sleep(0.0002)
+        # Mixed into the block that plays once the current one is over
+        latencies.append((time.perf_counter() - start + block) * 1000)
+        time.sleep(interval)
+    underruns = engine.underruns - underruns
+
+    for voice in background:
+        engine.note_off(voice)
+    latencies.sort()
+    return {
+        "underruns": underruns,
+        "notes": len(latencies),
+        "median_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "max_ms": latencies[-1],
+    }
+
+
+def probe(sample_rate=44100, buffer_size=256, channels=2, seconds=0.5, load=8):
+    """Open the device with these settings and measure() it; the device must be free."""
+    engine = AudioEngine(sample_rate, buffer_size, channels, max_voices=load + 4)
+    engine.start()
+    try:
+        result = measure(engine, seconds, load)
+    finally:
+        engine.stop()
+    result.update(sample_rate=sample_rate, buffer_size=buffer_size, channels=channels,
+                  buffer_ms=buffer_size / sample_rate * 1000)
+    return result
+
+
+def autotune(sample_rate=44100, channels=2, sizes=BUFFER_SIZES, seconds=0.5, load=8, on_step=None):
+    """Smallest stable buffer size: (settings, report of every size tried).
+
+    Sizes are tried from the largest down and the search stops at the first
+    one with underruns. If even the largest underruns, it is kept anyway.
+    """
+    trials = []
+    stable = None
+    for buffer_size in sorted(sizes, reverse=True):
+        result = probe(sample_rate, buffer_size, channels, seconds, load)
+        trials.append(result)
+        if on_step is not None:
+            on_step(result)
+        if result["underruns"]:
+            break
+        stable = result
+    chosen = stable or trials[0]
+    settings = {"sample_rate": sample_rate, "buffer_size": chosen["buffer_size"], "channels": channels}
+    return settings, trials
+
+
+def format_result(result):
+    return (f"{result['buffer_size']:>5} frames ({result['buffer_ms']:5.1f} ms buffer): "
+            f"{result['underruns']} underruns, output latency median {result['median_ms']:.1f} ms, "
+            f"p95 {result['p95_ms']:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune and measure the audio device for low latency.")
+    parser.add_argument("--autotune", action="store_true", help="find the smallest buffer size without underruns")
+    parser.add_argument("-r", "--sample-rate", type=int, help="sample rate (default: the saved setting)")
+    parser.add_argument("-b", "--buffer-size", type=int, help="buffer size in frames (default: the saved setting)")
+    parser.add_argument("-c", "--channels", type=int, choices=(1, 2), help="output channels (default: the saved setting)")
+    parser.add_argument("-s", "--seconds", type=float, default=0.5, help="measuring time per setting")
+    parser.add_argument("--load", type=int, default=8, help="silent voices playing while measuring")
+    parser.add_argument("--save", action="store_true", help=f"store the settings in {CONFIG_FILE}")
+    parser.add_argument("--config", default=CONFIG_FILE, help="configuration file to read and update")
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.config)
+    for name in DEFAULT_SETTINGS:
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    try:
+        if args.autotune:
+            settings, _ = autotune(settings["sample_rate"], settings["channels"], seconds=args.seconds,
+                                   load=args.load, on_step=lambda result: print(format_result(result)))
+            print(f"Smallest stable buffer: {settings['buffer_size']} frames")
+        else:
+            print(format_result(probe(settings["sample_rate"], settings["buffer_size"], settings["channels"],
+                                      args.seconds, args.load)))
+    except RuntimeError as e:
+        print(e)
+        return 1
+    if args.save:
+        save_settings(settings, args.config)
+        print(f"Saved to {args.config}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
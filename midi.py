@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Standard MIDI File import.
+
+Reads format 0 and 1 .mid files (format 2 tracks are simply merged) without
+any external package. Each track is scanned once for its note-on/note-off
+and tempo events, collected as flat integer arrays; tick-to-second
+conversion against the tempo map is then done for all events at once, and
+matching note-ons and note-offs become the rows of a compiled score (see
+score.py), so chords and overlapping notes play and render like any score.
+"""
+
+import struct
+
+import numpy as np
+
+from notes import note_table
+from score import SCORE_DTYPE, Score
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+# Tempo until the file sets one: 120 beats per minute
+DEFAULT_TEMPO = 500000  # Microseconds per quarter note
+
+# General MIDI percussion channel (10, counted from 1): not pitched notes
+DRUM_CHANNEL = 9
+
+
+def is_midi(path):
+    return path.lower().endswith(MIDI_EXTENSIONS)
+
+
+def _truncated():
+    return ValueError("truncated MIDI track")
+
+
+def _read_track(data, pos, end, events, tempos):
+    # Appends (tick, is_on, channel, key) to `events` and (tick, tempo) to `tempos`.
+    # Every read is checked against the end of the track, so a truncated or
+    # corrupt file raises ValueError rather than reading past it
+    tick = 0
+    running = 0
+    append = events.extend
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7F
+        while byte & 0x80:
+            if pos >= end:
+                raise _truncated()
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+        tick += delta
+
+        if pos >= end:
+            raise _truncated()
+        status = data[pos]
+        if status & 0x80:
+            pos += 1
+            if status < 0xF0:
+                running = status
+        elif running:
+            status = running  # Running status: the data byte was already read
+        else:
+            raise ValueError(f"Corrupt MIDI track at byte {pos}")
+
+        kind = status & 0xF0
+        if kind == 0x90 or kind == 0x80:
+            if pos + 2 > end:
+                raise _truncated()
+            # Note-on with velocity 0 is a note-off
+            append((tick, kind == 0x90 and data[pos + 1] > 0, status & 0x0F, data[pos]))
+            pos += 2
+        elif kind == 0xC0 or kind == 0xD0:
+            pos += 1
+        elif kind != 0xF0:
+            pos += 2
+        else:
+            if status == 0xFF:
+                if pos >= end:
+                    raise _truncated()
+                meta = data[pos]
+                pos += 1
+            # Meta and system exclusive events carry a variable-length size
+            byte = 0x80
+            length = 0
+            while byte & 0x80:
+                if pos >= end:
+                    raise _truncated()
+                byte = data[pos]
+                pos += 1
+                length = (length << 7) | (byte & 0x7F)
+            if pos + length > end:
+                raise _truncated()
+            if status == 0xFF:
+                if meta == 0x51 and length == 3:
+                    tempos.append((tick, (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2]))
+                elif meta == 0x2F:
+                    break  # End of track
+            pos += length
+        if pos > end:
+            raise _truncated()
+
+
+def read_events(path):
+    """Note events of a MIDI file: (seconds, is_on, channel, key) arrays, sorted by time."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd" or len(data) < 14:
+        raise ValueError(f"{path} is not a MIDI file")
+    header_length, _, track_count, division = struct.unpack(">IHHh", data[4:14])
+    if division == 0 or (division < 0 and not (-(division >> 8) and division & 0xFF)):
+        raise ValueError(f"{path}: invalid MIDI time division")
+
+    events = []
+    tempos = []
+    pos = 8 + header_length
+    for _ in range(track_count):
+        if data[pos:pos + 4] != b"MTrk":
+            break
+        if pos + 8 > len(data):
+            raise _truncated()
+        length = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        _read_track(data, pos + 8, min(pos + 8 + length, len(data)), events, tempos)
+        pos += 8 + length
+
+    events = np.array(events, dtype=np.int64).reshape(-1, 4)
+    ticks = events[:, 0]
+
+    if division < 0:
+        # SMPTE time: frames per second and ticks per frame, no tempo map
+        seconds = ticks / (-(division >> 8) * (division & 0xFF))
+    else:
+        tempo_map = np.array(sorted(tempos) or [(0, DEFAULT_TEMPO)], dtype=np.int64).reshape(-1, 2)
+        if tempo_map[0, 0] > 0:
+            tempo_map = np.vstack(([0, DEFAULT_TEMPO], tempo_map))
+        # Seconds elapsed at every tempo change, then each event from the last change before it
+        change_ticks, change_tempos = tempo_map[:, 0], tempo_map[:, 1] / (1e6 * division)
+        change_seconds = np.concatenate(([0.0], np.cumsum(np.diff(change_ticks) * change_tempos[:-1])))
+        segment = np.searchsorted(change_ticks, ticks, side="right") - 1
+        seconds = change_seconds[segment] + (ticks - change_ticks[segment]) * change_tempos[segment]
+
+    # Sorted by time, note-offs first so a note retriggered on the same tick is closed before it restarts
+    order = np.lexsort((events[:, 1], seconds))
+    return seconds[order], events[order, 1].astype(bool), events[order, 2], events[order, 3]
+
+
+def pair_notes(seconds, is_on, voices):
+    """Match note-ons with note-offs per voice: (start, duration, voice) arrays.
+
+    Each note-off closes the earliest note still sounding with its voice
+    (channel * 128 + key); note-offs with nothing sounding are ignored, and
+    notes never released last until the last event. Events must be sorted by
+    time. Everything is computed with whole-array operations, voice by voice
+    through one stable sort.
+    """
+    count = len(seconds)
+    if not count:
+        empty = np.zeros(0)
+        return empty, empty, np.zeros(0, dtype=np.int64)
+    order = np.argsort(voices, kind="stable")
+    seconds, is_on, voices = seconds[order], is_on[order], voices[order]
+    group = np.concatenate(([0], np.cumsum(voices[1:] != voices[:-1])))
+    first = np.concatenate(([0], np.flatnonzero(voices[1:] != voices[:-1]) + 1))
+
+    # Notes sounding after each event, never below zero: the running sum
+    # minus its running minimum, with every voice shifted far below the
+    # previous ones so the running minimum cannot leak across voices
+    step = np.where(is_on, 1, -1)
+    total = np.cumsum(step)
+    total -= (total - step)[first][group]
+    shift = group * (2 * count + 2)
+    sounding = total - (np.minimum.accumulate(np.minimum(total, 0) - shift) + shift)
+    before = np.roll(sounding, 1)
+    before[first] = 0
+    valid_off = ~is_on & (before > 0)
+
+    # The k-th note-on of a voice is closed by its k-th valid note-off
+    def rank(mask):
+        index = np.flatnonzero(mask)
+        counts = np.cumsum(mask)
+        return index, group[index] * count + counts[index] - (counts - mask)[first][group[index]]
+
+    on_index, on_key = rank(is_on)
+    off_index, off_key = rank(valid_off)
+    closed = on_index[np.searchsorted(on_key, off_key)]
+
+    duration = np.full(count, seconds.max()) - seconds
+    duration[closed] = seconds[off_index] - seconds[closed]
+    return seconds[on_index], duration[on_index], voices[on_index]
+
+
+def read_midi(path, include_drums=False):
+    """Compile a MIDI file into a Score, one row per sounding note."""
+    seconds, is_on, channels, keys = read_events(path)
+    if not include_drums:
+        pitched = channels != DRUM_CHANNEL
+        seconds, is_on, channels, keys = seconds[pitched], is_on[pitched], channels[pitched], keys[pitched]
+    starts, durations, voices = pair_notes(seconds, is_on, channels * 128 + keys)
+
+    notes = np.empty(len(starts), dtype=SCORE_DTYPE)
+    notes["start"] = starts
+    notes["duration"] = durations
+    notes["midi"] = voices % 128
+    notes["frequency"] = note_table.midi_frequencies(notes["midi"])
+    notes = notes[np.argsort(notes["start"], kind="stable")]
+    length = float(np.max(notes["start"] + notes["duration"])) if len(notes) else 0.0
+    return Score(notes, length)
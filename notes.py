@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Equal-tempered note table indexed by MIDI note number.
+
+Both naming schemes used by the app and the scores resolve to a MIDI index
+through one precompiled dictionary: solfège names ("Do", "Ré#"...) name the
+octave starting at middle C, scientific names ("C4", "A#5", "Bb3"...) carry
+their own octave. Frequencies are then a plain array lookup, and whole arrays
+of names or MIDI numbers can be converted in one call.
+"""
+
+import numpy as np
+
+MIDI_NOTES = 128
+A4 = 69
+
+SOLFEGE = ["Do", "Do#", "Ré", "Ré#", "Mi", "Fa", "Fa#", "Sol", "Sol#", "La", "La#", "Si"]
+SHARPS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+FLATS = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+
+# Solfège names without an octave are middle C's octave (Do = C4)
+SOLFEGE_BASE = 60
+
+
+def _build_index():
+    index = {}
+    for midi in range(MIDI_NOTES):
+        octave = midi // 12 - 1
+        index[f"{SHARPS[midi % 12]}{octave}"] = midi
+        index.setdefault(f"{FLATS[midi % 12]}{octave}", midi)
+    for pitch_class, name in enumerate(SOLFEGE):
+        index[name] = SOLFEGE_BASE + pitch_class
+    return index
+
+
+NOTE_INDEX = _build_index()
+
+
+def note_name(midi):
+    """Scientific name of a MIDI note number, e.g. 60 -> "C4"."""
+    return f"{SHARPS[midi % 12]}{midi // 12 - 1}"
+
+
+class NoteTable:
+    """MIDI-indexed frequencies for a configurable reference pitch (A4)."""
+
+    def __init__(self, reference_pitch=440.0):
+        self.set_reference_pitch(reference_pitch)
+
+    def set_reference_pitch(self, reference_pitch):
+        self.reference_pitch = float(reference_pitch)
+        self.frequencies = self.reference_pitch * 2 ** ((np.arange(MIDI_NOTES) - A4) / 12)
+
+    def __contains__(self, name):
+        return name in NOTE_INDEX
+
+    def index(self, name, octave=0):
+        """MIDI number of a note name, shifted by `octave` octaves."""
+        return NOTE_INDEX[name] + 12 * octave
+
+    def frequency(self, name, octave=0):
+        return float(self.frequencies[self.index(name, octave)])
+
+    def midi_frequencies(self, midi):
+        """Vectorized MIDI number -> frequency lookup."""
+        return self.frequencies[np.asarray(midi)]
+
+    def lookup(self, names, octave=0):
+        """MIDI numbers for a sequence of names; unknown names give -1."""
+        names = np.asarray(names)
+        if not names.size:
+            return np.zeros(0, dtype=np.int16)
+        # Each distinct name goes through the dictionary only once
+        distinct, inverse = np.unique(names, return_inverse=True)
+        midi = np.array([NOTE_INDEX.get(name, -1) for name in distinct.tolist()], dtype=np.int16)
+        midi = np.where(midi >= 0, midi + 12 * octave, -1)[inverse.reshape(names.shape)]
+        return midi.astype(np.int16)
+
+
+note_table = NoteTable()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Background pre-warming of playable notes.
+
+When an instrument layout becomes active, every note it can play is handed
+to a small pool of worker threads that prepare it with MusicPlayer.prepare():
+rendered into the sound cache on mixer channels, or with its wavetables and
+resonator design built when streaming. Playing never waits for the pool: a
+note that is not warm yet is simply synthesized on demand, as before.
+Selecting another layout abandons whatever the previous one had left.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+
+class Prewarmer:
+    """Prepares a layout's notes on worker threads, reporting progress."""
+
+    def __init__(self, player, workers=2, on_progress=None):
+        self.player = player
+        # Called as on_progress(done, total) from a worker thread
+        self.on_progress = on_progress
+        self.done = 0
+        self.total = 0
+        self.failed = 0
+        self._job = 0
+        self._futures = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prewarm")
+
+    @property
+    def running(self):
+        return self.done < self.total
+
+    def start(self, notes):
+        """Prepare (instrument, frequency, duration) notes, abandoning the previous batch."""
+        self.cancel()
+        notes = list(dict.fromkeys(notes))  # A note reachable from two keys is prepared once
+        with self._lock:
+            self._job += 1
+            job = self._job
+            self.done = self.failed = 0
+            self.total = len(notes)
+        self._futures = [self._pool.submit(self._prepare, job, *note) for note in notes]
+
+    def cancel(self, wait=False):
+        # Notes already being prepared finish (waited for with `wait`); the
+        # queued ones are dropped
+        with self._lock:
+            self._job += 1
+            self.total = self.done
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+        if wait:
+            wait_futures(futures)
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=True)
+
+    def _prepare(self, job, instrument, frequency, duration):
+        if job != self._job:
+            return
+        failed = False
+        try:
+            self.player.prepare(instrument, frequency, duration)
+        except Exception as e:
+            # The note will be synthesized when played, as if never warmed
+            print(f"Could not prepare {instrument} {frequency:.2f} Hz: {e}")
+            failed = True
+        with self._lock:
+            if job != self._job:
+                return
+            self.done += 1
+            self.failed += failed
+            done, total = self.done, self.total
+        if self.on_progress is not None:
+            self.on_progress(done, total)
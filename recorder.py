@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Timestamped performance recording.
+
+Every note-on and note-off is stored with its time.monotonic() offset from
+the start of the take in a fixed-size, array-backed ring buffer, so adding an
+event never allocates. A background thread appends the buffered events to a
+journal file as the take goes on: memory stays bounded however long the
+session lasts, and a crash only loses the last fraction of a second. The
+journal is exported to the `note duration` score format with the real note
+lengths and the rests between them.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from notes import note_name
+
+EVENT_DTYPE = np.dtype([("time", np.float64), ("midi", np.int16), ("on", np.bool_)])
+
+# Events are journaled with the .events extension next to the exported score
+JOURNAL_SUFFIX = ".events"
+
+
+class PerformanceRecorder:
+    """Ring-buffered note event recorder with a background journal writer."""
+
+    def __init__(self, capacity=4096, flush_interval=0.5):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.path = None
+        self.dropped = 0
+        self._head = 0  # Events recorded so far
+        self._flushed = 0  # Events already written to the journal
+        self._origin = 0.0
+        self._file = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    @property
+    def recording(self):
+        return self._file is not None
+
+    def start(self, path):
+        """Start a new take journaled to `path` (truncated if it exists)."""
+        self.stop()
+        self.path = path
+        self.dropped = 0
+        self._head = self._flushed = 0
+        self._file = open(path, "wb")
+        self._origin = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Finish the take, flushing whatever is still buffered."""
+        if self._file is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def note_on(self, midi, timestamp=None):
+        self._record(midi, True, timestamp)
+
+    def note_off(self, midi, timestamp=None):
+        self._record(midi, False, timestamp)
+
+    def note(self, midi, duration):
+        """A note of known length starting now (e.g. a mouse click)."""
+        now = time.monotonic()
+        self._record(midi, True, now)
+        self._record(midi, False, now + duration)
+
+    def flush(self):
+        with self._lock:
+            start, end = self._flushed, self._head
+            first, last = start % self.capacity, end % self.capacity
+            if end - start == 0:
+                return
+            if first < last:
+                chunk = self.events[first:last].copy()
+            else:  # Wrapped around the end of the ring
+                chunk = np.concatenate((self.events[first:], self.events[:last]))
+        chunk.tofile(self._file)
+        self._file.flush()
+        with self._lock:
+            self._flushed = end
+
+    def _record(self, midi, on, timestamp):
+        if self._file is None:
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            pending = self._head - self._flushed
+            if pending >= self.capacity:
+                # The writer fell a whole ring behind: drop rather than overwrite
+                self.dropped += 1
+                return
+            self.events[self._head % self.capacity] = (timestamp - self._origin, midi, on)
+            self._head += 1
+        if pending + 1 >= self.capacity // 2:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def load_events(path):
+    """Read a journal written by PerformanceRecorder."""
+    return np.fromfile(path, dtype=EVENT_DTYPE)
+
+
+def pair_notes(events):
+    """Match note-ons with their note-offs: (midi, start, duration) tuples by onset."""
+    events = events[np.argsort(events["time"], kind="stable")]
+    held = {}
+    notes = []
+    for time_, midi, on in events.tolist():
+        if on:
+            held.setdefault(midi, []).append(time_)
+        elif held.get(midi):
+            start = held[midi].pop(0)
+            notes.append((midi, start, time_ - start))
+    # Notes still held when the take ended last until the final event
+    end = float(events["time"].max()) if len(events) else 0.0
+    for midi, starts in held.items():
+        notes.extend((midi, start, end - start) for start in starts)
+    notes.sort(key=lambda note: note[1])
+    return notes
+
+
+def export_score(events, path, precision=3):
+    """Write events in the `note duration` format, with rests between notes.
+
+    The format is monophonic: each line starts when the previous one ends. A
+    note released after the next one started is shortened to keep the next
+    onset in place, and notes starting together keep only the first of them.
+    A note too short to write keeps its time in the score as part of the
+    following rest, so the notes after it stay in place.
+    """
+    step = 10 ** -precision
+    notes = []
+    for note in pair_notes(events):
+        if not notes or note[1] - notes[-1][1] >= step / 2:
+            notes.append(note)
+    lines = []
+    # Score time covered by the lines written so far, from their rounded
+    # values: each rest is measured from it, so rounding never accumulates
+    written = 0.0
+    for index, (midi, start, duration) in enumerate(notes):
+        if index + 1 < len(notes):
+            duration = min(duration, notes[index + 1][1] - start)
+        duration = round(duration, precision)
+        if duration < step:
+            continue
+        rest = round(start - written, precision)
+        if rest >= step:
+            lines.append(f"0 {rest}")
+            written += rest
+        lines.append(f"{note_name(midi)} {duration}")
+        written += duration
+
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+    return len(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a recording journal to a `note duration` score.")
+    parser.add_argument("journal", help="recording journal (.events)")
+    parser.add_argument("-o", "--output", help="score file to write (default: the journal name with .txt)")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.journal)[0] + ".txt"
+    lines = export_score(load_events(args.journal), output)
+    print(f"Wrote {lines} lines to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Offline score renderer.
+
+Renders a score in the `note duration` text format (see mario.txt), or a
+Standard MIDI file, to a WAV file with the same timbres as the live
+instruments, without any display or sound card, and much faster than real
+time.
+
+    python render.py mario.txt -o mario.wav --instrument videogame
+
+Several scores, directories of scores or glob patterns are rendered in
+parallel by a pool of worker processes, each keeping its own cache of the
+note waveforms it has already synthesized:
+
+    python render.py scores/ "more/*.txt" -d wav/ -j 8
+
+With --bank, notes are also looked up in and added to a persistent sample
+bank (see samplebank.py), shared by all the workers, later runs and the app.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import synthesis
+from midi import MIDI_EXTENSIONS
+from samplebank import SampleBank
+from score import compile_score
+
+SCORE_EXTENSIONS = (".txt",) + MIDI_EXTENSIONS
+
+
+# Note waveforms kept by a process across the scores it renders
+TONE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class ToneCache:
+    """Rendered notes by (instrument, frequency, duration, sample rate), least recently used out first.
+
+    Notes found in the sample bank are not copied in: they are returned as
+    the bank's int16 views of its file, which render_score() scales as it
+    mixes them.
+    """
+
+    def __init__(self, max_bytes=TONE_CACHE_BYTES, bank=None):
+        self.max_bytes = max_bytes
+        self.bank = bank
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tones = OrderedDict()
+
+    def tones(self, instrument, pairs, sample_rate):
+        """{(frequency, duration): tone} for the pairs, rendering the missing ones in one batch."""
+        keys = {pair: (instrument, pair[0], pair[1], sample_rate) for pair in pairs}
+        tones = {}
+        missing = []
+        for pair, key in keys.items():
+            tone = self._tones.get(key)
+            if tone is None:
+                missing.append(pair)
+            else:
+                self._tones.move_to_end(key)
+                tones[pair] = tone
+        self.hits += len(tones)
+        self.misses += len(missing)
+        if self.bank is not None:
+            missing = self._from_bank(instrument, missing, sample_rate, tones)
+        # This score's notes that are (or will be) kept here rather than in the bank
+        cached = len(missing) + sum(key in self._tones for key in keys.values())
+        rendered = synthesis.render_batch(instrument, missing, sample_rate)
+        for pair, tone in zip(missing, rendered):
+            self._tones[keys[pair]] = tones[pair] = tone
+            self.current_bytes += tone.nbytes
+            if self.bank is not None:
+                self.bank.put(self._bank_key(instrument, pair, sample_rate), synthesis.pcm16(tone, 1))
+
+        # Least recently used notes go first once over budget; this score's stay
+        while self.current_bytes > self.max_bytes and len(self._tones) > cached:
+            _, tone = self._tones.popitem(last=False)
+            self.current_bytes -= tone.nbytes
+        return tones
+
+    def _bank_key(self, instrument, pair, sample_rate):
+        # Rounded like MusicPlayer's cache keys, so the app finds these notes too
+        return (instrument, round(pair[0], 3), round(pair[1], 4), sample_rate)
+
+    def _from_bank(self, instrument, pairs, sample_rate, tones):
+        # Adds the banked notes to `tones`; returns the pairs still to render
+        missing = []
+        for pair in pairs:
+            samples = self.bank.get(self._bank_key(instrument, pair, sample_rate))
+            if samples is None:
+                missing.append(pair)
+            else:
+                tones[pair] = samples
+        return missing
+
+
+_tone_cache = ToneCache()
+
+
+def use_bank(path):
+    """Look notes up in (and add them to) the sample bank at `path`; None for no bank."""
+    if path is None:
+        _tone_cache.bank = None
+    elif _tone_cache.bank is None or _tone_cache.bank.path != path:
+        _tone_cache.bank = SampleBank(path)
+
+
+def render_score(score, instrument="piano", sample_rate=44100, cache=None):
+    """Mix a compiled score into one float array."""
+    notes = score.notes
+    starts = np.rint(notes["start"] * sample_rate).astype(np.int64)
+    frequencies = notes["frequency"].astype(float)
+    durations = notes["duration"].astype(float)
+
+    # Each distinct note is synthesized once, in a single batch
+    pairs = list(zip(frequencies.tolist(), durations.tolist()))
+    distinct = sorted(set(pairs))
+    if cache is not None:
+        tones = cache.tones(instrument, distinct, sample_rate)
+    else:
+        tones = dict(zip(distinct, synthesis.render_batch(instrument, distinct, sample_rate)))
+
+    total = int(round(score.length * sample_rate))
+    for start, pair in zip(starts, pairs):
+        total = max(total, start + len(tones[pair]))
+    out = np.zeros(total, dtype=np.float32)
+    banked = None
+    for start, pair in zip(starts, pairs):
+        tone = tones[pair]
+        mix = out
+        if tone.dtype == np.int16:
+            # Notes read from the sample bank are mixed apart as they are
+            # and scaled once at the end, instead of each being converted
+            if banked is None:
+                banked = np.zeros(total, dtype=np.float32)
+            mix = banked
+        mix[start:start + len(tone)] += tone
+    if banked is not None:
+        banked *= np.float32(1 / 32767)
+        out += banked
+    return out
+
+
+def write_wav(path, samples, sample_rate=44100, channels=2):
+    peak = np.max(np.abs(samples)) if len(samples) else 0
+    if peak > 1:
+        samples = samples * np.float32(1 / peak)
+    pcm = synthesis.pcm16(samples, channels)  # Entrelace gauche/droite
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def find_scores(patterns):
+    """Score files named by paths, directories (their score and MIDI files) or glob patterns."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [path for extension in SCORE_EXTENSIONS for path in glob.glob(os.path.join(pattern, "*" + extension))]
+        else:
+            matches = glob.glob(pattern) or [pattern]
+        for path in sorted(matches):
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def render_file(path, output, instrument="piano", sample_rate=44100, channels=2, bank=None, cache_scores=False):
+    """Render one score file to WAV; returns (output, audio seconds, notes, elapsed seconds).
+
+    The compiled score is only cached next to the score file with `cache_scores`.
+    """
+    start = time.perf_counter()
+    use_bank(bank)
+    score = compile_score(path, instrument, use_cache=cache_scores)
+    samples = render_score(score, instrument, sample_rate, _tone_cache)
+    write_wav(output, samples, sample_rate, channels)
+    return output, len(samples) / sample_rate, len(score), time.perf_counter() - start
+
+
+def render_files(jobs, instrument="piano", sample_rate=44100, channels=2, workers=None, bank=None,
+                 cache_scores=False):
+    """Render (score, output) pairs in a process pool, yielding render_file() results as they finish.
+
+    Rendering happens in the workers, which write their WAV files themselves:
+    only file names and timings travel between processes.
+    """
+    if workers == 1:
+        for path, output in jobs:
+            yield (path,) + render_file(path, output, instrument, sample_rate, channels, bank, cache_scores)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_file, path, output, instrument, sample_rate, channels, bank, cache_scores): path
+                   for path, output in jobs}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render score files to WAV without playing them.")
+    parser.add_argument("scores", nargs="+", help="score files ('note duration' format or MIDI), directories or glob patterns")
+    parser.add_argument("-o", "--output", help="output WAV file for a single score (default: score name with .wav)")
+    parser.add_argument("-d", "--output-dir", help="directory for the WAV files (default: next to each score)")
+    parser.add_argument("-i", "--instrument", choices=synthesis.INSTRUMENTS, default="piano")
+    parser.add_argument("-r", "--sample-rate", type=int, default=44100)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+    parser.add_argument("--mono", action="store_true", help="write a single channel")
+    parser.add_argument("--bank", help="sample bank file to reuse and extend with the rendered notes")
+    parser.add_argument("--cache-scores", action="store_true",
+                        help="keep the compiled scores next to the score files, as the app does")
+    args = parser.parse_args(argv)
+
+    scores = find_scores(args.scores)
+    if not scores:
+        parser.error("no score files found")
+    if args.output and len(scores) > 1:
+        parser.error("-o/--output needs a single score; use -d/--output-dir")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = []
+    for path in scores:
+        name = os.path.splitext(os.path.basename(path))[0] + ".wav"
+        if args.output:
+            output = args.output
+        elif args.output_dir:
+            output = os.path.join(args.output_dir, name)
+        else:
+            output = os.path.splitext(path)[0] + ".wav"
+        jobs.append((path, output))
+
+    workers = max(1, min(args.jobs or 1, len(jobs)))
+    start = time.perf_counter()
+    total_audio = total_busy = 0.0
+    for _, output, length, _, elapsed in render_files(jobs, args.instrument, args.sample_rate,
+                                                      1 if args.mono else 2, workers, args.bank,
+                                                      args.cache_scores):
+        speed = length / elapsed if elapsed else float("inf")
+        print(f"{output}: {length:.2f} s of audio rendered in {elapsed:.3f} s ({speed:.0f}x real time)")
+        total_audio += length
+        total_busy += elapsed
+    wall = time.perf_counter() - start
+
+    if len(jobs) > 1:
+        print(f"{len(jobs)} files, {total_audio:.1f} s of audio in {wall:.2f} s with {workers} worker(s): "
+              f"{len(jobs) / wall:.1f} files/s, {total_audio / wall:.0f}x real time, "
+              f"{total_busy / wall:.1f} workers busy on average")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent sample bank.
+
+Rendered notes are kept on disk as mono int16 samples, all in one file: a
+header, a fixed-size index of (instrument, frequency, duration, sample rate)
+rows and the samples themselves, appended one note after the other. The file
+is read through np.memmap, so opening it costs nothing whatever its size,
+a note is a view of the mapped pages rather than a copy, and every process
+using the same bank (the app, render.py workers) shares those pages through
+the operating system's file cache.
+
+The header records a hash of the timbre parameters and of the code that
+renders them (synthesis_version()). A bank written by any other version is
+replaced by an empty one the first time it is opened, so changing a timbre
+never plays stale notes. Adding notes takes a lock file next to the bank,
+which keeps processes from appending at the same time.
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import synthesis
+import wavetable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MAGIC = b"SMPLBANK"
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "S16"), ("count", "<u4"), ("capacity", "<u4"), ("data_end", "<u8"),
+])
+INDEX_DTYPE = np.dtype([
+    ("instrument", "S12"), ("frequency", "<f8"), ("duration", "<f8"), ("sample_rate", "<u4"),
+    ("frames", "<u4"), ("offset", "<u8"),
+])
+HEADER_SIZE = 64
+
+# Samples start on a page boundary after the index
+PAGE_SIZE = 4096
+
+LOCK_SUFFIX = ".lock"
+
+
+def synthesis_version():
+    """Hash of what rendered notes depend on: timbre parameters and the rendering code."""
+    digest = hashlib.sha1()
+    for name in sorted(dir(synthesis)):
+        if name.isupper() and not name.startswith("_"):
+            digest.update(f"{name}={getattr(synthesis, name)!r}".encode())
+    for module in (synthesis, wavetable):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+@contextmanager
+def _file_lock(path):
+    # Exclusive lock between processes, held on a separate file so that the
+    # bank itself can be replaced while locked
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SampleBank:
+    """Rendered int16 notes in one memory-mapped file, shared across processes.
+
+    Keys are (instrument, frequency, duration, sample rate) tuples, rounded
+    by the caller. The file is only touched on first use; if it cannot be
+    read or written the bank stays empty and notes are simply synthesized.
+    """
+
+    def __init__(self, path, capacity=4096, max_bytes=512 * 1024 * 1024, version=None):
+        self.path = path
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.version = (version or synthesis_version()).encode()
+        self.enabled = True
+        self.full = False
+        self.hits = 0
+        self.misses = 0
+        self._map = None
+        self._index = {}  # key -> (offset, frames)
+        self._count = 0
+        self._data_end = 0
+        # Notes are looked up from the GUI, sequencer and pre-warming threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key):
+        """The note's samples as a read-only int16 view of the file, or None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None and self._changed() and self._refresh():
+                entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            offset, frames = entry
+            return self._map[offset:offset + 2 * frames].view(np.int16)
+
+    def put(self, key, samples):
+        """Store a note's mono int16 samples; False if not stored (already there, full, unwritable)."""
+        samples = np.ascontiguousarray(samples, dtype=np.int16).ravel()
+        instrument, frequency, duration, sample_rate = key
+        with self._lock:
+            if not self.enabled or self.full:
+                return False
+            try:
+                with _file_lock(self.path + LOCK_SUFFIX):
+                    # Pick up notes added by other processes since we last looked
+                    self._refresh(locked=True)
+                    if not self.enabled or key in self._index:
+                        return False
+                    offset = self._data_end
+                    if self._count >= self.capacity or offset + samples.nbytes > self.max_bytes:
+                        self.full = True
+                        return False
+
+                    row = np.zeros(1, dtype=INDEX_DTYPE)
+                    row[0] = (instrument, frequency, duration, sample_rate, len(samples), offset)
+                    header = np.zeros(1, dtype=HEADER_DTYPE)
+                    header[0] = (MAGIC, self.version, self._count + 1, self.capacity, offset + samples.nbytes)
+                    with open(self.path, "r+b") as f:
+                        # Samples and index row first: readers only trust the header's count
+                        f.seek(offset)
+                        f.write(samples.tobytes())
+                        f.seek(HEADER_SIZE + self._count * INDEX_DTYPE.itemsize)
+                        f.write(row.tobytes())
+                        f.flush()
+                        f.seek(0)
+                        f.write(header.tobytes())
+            except OSError as e:
+                self._disable(e)
+                return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": max(self._data_end - self._data_start(), 0),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _data_start(self):
+        index_end = HEADER_SIZE + self.capacity * INDEX_DTYPE.itemsize
+        return -(-index_end // PAGE_SIZE) * PAGE_SIZE
+
+    def _changed(self):
+        # Whether notes were added since the file was mapped: its header is
+        # part of the mapping, so the count is read without a system call
+        if self._map is None:
+            return True
+        return int(self._map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]["count"]) != self._count
+
+    def _read_header(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read(HEADER_DTYPE.itemsize)
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER_DTYPE.itemsize:
+            return None
+        return np.frombuffer(data, dtype=HEADER_DTYPE)[0]
+
+    def _refresh(self, locked=False):
+        # Map the file again if notes were added to it; True if the index changed
+        if not self.enabled:
+            return False
+        try:
+            header = self._read_header()
+            if header is None or header["magic"] != MAGIC or header["version"] != self.version:
+                if not locked:
+                    with _file_lock(self.path + LOCK_SUFFIX):
+                        return self._refresh(locked=True)
+                self._create()
+                header = self._read_header()
+            if self._map is not None and header["count"] == self._count:
+                return False
+
+            mapped = np.memmap(self.path, dtype=np.uint8, mode="r")
+        except OSError as e:
+            self._disable(e)
+            return False
+        # The mapped header is the one to trust: a writer may have moved on since
+        header = mapped[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        self.capacity = int(header["capacity"])
+        count = min(int(header["count"]), self.capacity)
+        rows = mapped[HEADER_SIZE:HEADER_SIZE + count * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        index = {}
+        for instrument, frequency, duration, sample_rate, frames, offset in rows.tolist():
+            if offset + 2 * frames <= len(mapped):
+                index[(instrument.decode(), frequency, duration, sample_rate)] = (offset, frames)
+        self._map, self._index, self._count = mapped, index, count
+        self._data_end = int(header["data_end"])
+        return True
+
+    def _create(self):
+        # An empty bank for this version. It is written aside and moved into
+        # place, so processes still mapping the old file keep valid pages.
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (MAGIC, self.version, 0, self.capacity, self._data_start())
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(self._data_start())
+        os.replace(temporary, self.path)
+        self._map = None
+        self._index = {}
+        self._count = 0
+        self.full = False
+
+    def _disable(self, error):
+        # Unreadable or unwritable bank: carry on without it
+        print(f"Sample bank {self.path} unavailable: {error}")
+        self.enabled = False
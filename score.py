@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Score parsing and compilation.
+
+A score in the `note duration` text format is streamed line by line and
+compiled into a NumPy structured array of (frequency, start, duration, midi),
+one row per sounding note. Note names are resolved through the MIDI note
+table a chunk of lines at a time. The compiled array is cached next to the
+score file and reused, through a memory map, as long as the file's mtime and
+size (and the tuning) do not change. Standard MIDI files (see midi.py) are
+compiled into the same array and cached the same way.
+"""
+
+import json
+import os
+from itertools import islice
+
+import numpy as np
+
+from notes import SOLFEGE, note_table
+
+RESTS = ("0", "Unknown")
+
+SCORE_DTYPE = np.dtype([
+    ("frequency", np.float64), ("start", np.float64), ("duration", np.float64), ("midi", np.int16),
+])
+
+# Bump when the compiled layout or the note table changes
+CACHE_VERSION = 2
+
+# Lines compiled together with one vectorized note lookup
+CHUNK_LINES = 4096
+
+
+class Score:
+    """A compiled score: its notes, total length and unrecognised note names."""
+
+    def __init__(self, notes, length, unknown=()):
+        self.notes = notes
+        self.length = length
+        self.unknown = list(unknown)
+
+    def __len__(self):
+        return len(self.notes)
+
+
+def iter_score(path):
+    """Yield (note, duration) pairs from a score file, one line at a time."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            note, duration = parts
+            try:
+                yield note, float(duration)
+            except ValueError:
+                continue
+
+
+def instrument_octave(instrument):
+    # Solfège names carry no octave; the video game plays them two octaves up
+    return 2 if instrument == "videogame" else 0
+
+
+def compile_notes(pairs, instrument="piano", table=note_table):
+    """Compile an iterable of (note, duration) pairs into a Score."""
+    pairs = iter(pairs)
+    chunks = []
+    unknown = []
+    elapsed = 0.0
+
+    while True:
+        chunk = list(islice(pairs, CHUNK_LINES))
+        if not chunk:
+            break
+        names = np.array([note for note, _ in chunk])
+        durations = np.array([duration for _, duration in chunk], dtype=np.float64)
+
+        midi = table.lookup(names)
+        if instrument_octave(instrument):
+            midi[(midi >= 0) & np.isin(names, SOLFEGE)] += 12 * instrument_octave(instrument)
+        # Les notes inconnues comptent comme des silences
+        for name in names[(midi < 0) & ~np.isin(names, RESTS)].tolist():
+            if name not in unknown:
+                unknown.append(name)
+
+        # Every line, rests included, moves the onset of the following one
+        starts = np.cumsum(np.concatenate(([elapsed], durations)))
+        elapsed = float(starts[-1])
+
+        sounding = midi >= 0
+        notes = np.empty(int(sounding.sum()), dtype=SCORE_DTYPE)
+        notes["midi"] = midi[sounding]
+        notes["frequency"] = table.midi_frequencies(notes["midi"])
+        notes["start"] = starts[:-1][sounding]
+        notes["duration"] = durations[sounding]
+        chunks.append(notes)
+
+    notes = np.concatenate(chunks) if chunks else np.empty(0, dtype=SCORE_DTYPE)
+    return Score(notes, elapsed, unknown)
+
+
+def cache_paths(path, instrument):
+    directory, name = os.path.split(os.path.abspath(path))
+    base = os.path.join(directory, f".{name}.{instrument}.score")
+    return base + ".npy", base + ".json"
+
+
+def _load_cached(path, instrument, stat):
+    data_path, meta_path = cache_paths(path, instrument)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if (meta.get("version") != CACHE_VERSION or meta.get("mtime_ns") != stat.st_mtime_ns
+                or meta.get("size") != stat.st_size or meta.get("reference_pitch") != note_table.reference_pitch):
+            return None
+        notes = np.load(data_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if notes.dtype != SCORE_DTYPE:
+        return None
+    return Score(notes, meta["length"], meta.get("unknown", []))
+
+
+def _store_cached(path, instrument, stat, score):
+    data_path, meta_path = cache_paths(path, instrument)
+    meta = {
+        "version": CACHE_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "reference_pitch": note_table.reference_pitch,
+        "length": score.length,
+        "unknown": score.unknown,
+    }
+    try:
+        np.save(data_path, score.notes)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+    except OSError:
+        pass  # Read-only directory: the score simply isn't cached
+
+
+def compile_score(path, instrument="piano", use_cache=True):
+    """Compile a score or MIDI file, reusing its on-disk cache when still valid."""
+    # midi.py builds on this module, hence the late import
+    from midi import is_midi, read_midi
+
+    stat = os.stat(path)
+    if use_cache:
+        score = _load_cached(path, instrument, stat)
+        if score is not None:
+            return score
+
+    if is_midi(path):
+        score = read_midi(path)  # MIDI notes carry their own octave
+    else:
+        score = compile_notes(iter_score(path), instrument)
+    for note in score.unknown:
+        print(f"Note {note} not recognized.")
+    if use_cache:
+        _store_cached(path, instrument, stat, score)
+    return score
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Drift-free score playback.
+
+The sequencer plays a compiled score (see score.py) from a background thread.
+Every note onset is scheduled against an absolute time.monotonic() deadline
+measured from the start of playback, so synthesis time never pushes the
+following notes later. Notes coming up within the look-ahead window are
+rendered before their deadline, and the difference between each deadline
+and the moment the note actually started is recorded as onset jitter.
+
+The compiled score's sorted onsets are the cumulative-time index of the
+piece: seeking to a time or a note number is a binary search in them, and a
+tempo multiplier only changes how score time maps to the clock. Playback can
+loop over a region; a short region is mixed once (per tempo) and every pass
+after the first plays that cached audio instead of its separate notes.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from score import Score
+
+
+class Sequencer:
+    """Plays compiled scores on a MusicPlayer from a worker thread."""
+
+    # Wake up this long before a deadline and finish the wait by polling
+    SPIN_MARGIN = 0.002
+
+    # Loop regions up to this long (in played seconds) are mixed and cached
+    LOOP_CACHE_SECONDS = 30.0
+
+    def __init__(self, player, lookahead=0.5, on_finished=None):
+        self.player = player
+        self.lookahead = lookahead
+        self.on_finished = on_finished
+        self.onset_errors = []
+        self.score = None
+        self.tempo = 1.0
+        self.loop = None  # (start, end) in score seconds
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._wake = threading.Event()
+        # Score time `_anchor` was reached at clock time `_origin`
+        self._origin = 0.0
+        self._anchor = 0.0
+        self._paused_at = None
+        self._seek_to = None
+        # The mixed loop region: only the latest one is kept. Its key is
+        # (score, instrument, loop, tempo, sample rate); guarded by _lock
+        self._loop_key = None
+        self._loop_tone = None
+        self._loop_rendering = None  # Key being mixed on a helper thread
+
+    @property
+    def playing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    @property
+    def position(self):
+        """Current time in the score, in score seconds."""
+        with self._lock:
+            now = self._paused_at if self._paused_at is not None else time.monotonic()
+            return self._anchor + (now - self._origin) * self.tempo
+
+    def start(self, score, instrument, position=0.0):
+        self.stop()
+        if score is not self.score:
+            with self._lock:
+                self._loop_key = self._loop_tone = self._loop_rendering = None
+        self.score = score
+        self.onset_errors = []
+        self._seek_to = None
+        self._paused_at = None
+        self._stop.clear()
+        self._resume.set()
+        self._thread = threading.Thread(target=self._run, args=(score, instrument, position), daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        self._resume.clear()
+        self._wake.set()
+
+    def resume(self):
+        self._resume.set()
+
+    def toggle_pause(self):
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._resume.set()
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def seek(self, seconds):
+        """Continue playback from `seconds` into the score."""
+        if self.score is not None:
+            self._seek_to = min(max(float(seconds), 0.0), self.score.length)
+            self._wake.set()
+
+    def seek_note(self, index):
+        """Continue playback from the onset of note `index` (counted from 0)."""
+        if self.score is not None and len(self.score):
+            self.seek(self.score.notes["start"][min(max(index, 0), len(self.score) - 1)])
+
+    def note_at(self, seconds):
+        """Number of the first note starting at or after `seconds`."""
+        return int(np.searchsorted(self.score.notes["start"], seconds, side="left"))
+
+    def set_tempo(self, tempo):
+        """Play `tempo` times as fast as written; takes effect immediately."""
+        if tempo <= 0:
+            raise ValueError("Tempo must be positive")
+        with self._lock:
+            now = self._paused_at if self._paused_at is not None else time.monotonic()
+            # Re-anchor so the score position does not jump
+            self._anchor += (now - self._origin) * self.tempo
+            self._origin = now
+            self.tempo = float(tempo)
+        self._wake.set()
+
+    def set_loop(self, start=None, end=None):
+        """Loop playback over [start, end) score seconds; no arguments to stop looping."""
+        if start is None or end is None:
+            self.loop = None
+        elif end <= start:
+            raise ValueError("The loop must end after it starts")
+        else:
+            self.loop = (float(start), float(end))
+        self._wake.set()
+
+    def jitter_stats(self):
+        """Onset error statistics, in milliseconds."""
+        if not self.onset_errors:
+            return {"notes": 0, "mean_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        errors = np.abs(np.array(self.onset_errors)) * 1000
+        return {
+            "notes": len(errors),
+            "mean_ms": float(errors.mean()),
+            "p95_ms": float(np.percentile(errors, 95)),
+            "max_ms": float(errors.max()),
+        }
+
+    def _deadline(self, offset):
+        with self._lock:
+            return self._origin + (offset - self._anchor) / self.tempo
+
+    def _wait_until(self, offset, tempo=None):
+        # Returns False when playback was stopped, paused or sent elsewhere
+        # meanwhile, or when the tempo is no longer `tempo` if given. The
+        # deadline is computed again after every wake-up, so a tempo change
+        # moves it.
+        while True:
+            if self._stop.is_set() or not self._resume.is_set() or self._seek_to is not None:
+                return False
+            if tempo is not None and self.tempo != tempo:
+                return False
+            remaining = self._deadline(offset) - time.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > self.SPIN_MARGIN:
+                self._wake.wait(remaining - self.SPIN_MARGIN)
+                self._wake.clear()
+            else:
+                time.sleep(0)
+
+    def _wait_for(self, offset):
+        # Wait until `offset` seconds into the score; False once stopped or seeking
+        while not self._stop.is_set() and self._seek_to is None:
+            if self._wait_until(offset):
+                return True
+            if not self._resume.is_set():
+                # Shift the time origin by however long we stayed paused
+                with self._lock:
+                    if self._paused_at is None:
+                        self._paused_at = time.monotonic()
+                self._resume.wait()
+                with self._lock:
+                    self._origin += time.monotonic() - self._paused_at
+                    self._paused_at = None
+        return False
+
+    def _start_at(self, position):
+        with self._lock:
+            self._origin = time.monotonic()
+            self._anchor = position
+            if self._paused_at is not None:
+                # Still paused: the clock stays at `position` until resumed
+                self._paused_at = self._origin
+
+    def _run(self, score, instrument, position):
+        notes = score.notes
+        starts = np.asarray(notes["start"])
+        frequencies = np.asarray(notes["frequency"]).tolist()
+        durations = np.asarray(notes["duration"]).tolist()
+
+        while True:
+            loop = self.loop
+            looping = loop is not None and position < loop[1]
+            end = loop[1] if looping else score.length
+            tone = self._cached_loop(score, instrument, loop) if looping and position == loop[0] else None
+            if tone is not None:
+                # Later passes: the whole region at once
+                reached = self._play_cached(tone, position, end)
+            else:
+                reached = self._play_notes(starts, frequencies, durations, instrument, position, end)
+                if reached and looping:
+                    # Mixed on a helper thread while the region's last notes
+                    # ring out, ready for the next pass if it is done by then
+                    self._render_loop(score, instrument, loop)
+                # Let the last note ring before going on
+                reached = reached and self._wait_for(end)
+
+            if self._stop.is_set():
+                return
+            if not reached:
+                # Sent elsewhere: cut what is still ringing and start over there
+                position, self._seek_to = self._seek_to, None
+                self.player.stop_all()
+                continue
+            if looping and self.loop == loop:
+                position = loop[0]
+                continue
+            if looping:
+                position = end  # The loop was changed or cleared during the pass
+                continue
+            break
+
+        if self.on_finished is not None:
+            self.on_finished(self.jitter_stats())
+
+    def _play_cached(self, tone, position, end):
+        tempo = self.tempo
+        self._start_at(position)
+        self.player.play_buffer(tone, blocking=False)
+        if self._wait_until(end, tempo):
+            return True
+        if self._stop.is_set() or self._seek_to is not None:
+            return False
+        # Paused, or the tempo changed: mixed audio can follow neither, so
+        # cut it and finish the pass note by note from where it stopped
+        # (once resumed). The next pass is mixed again at the new tempo
+        if not self._resume.is_set():
+            with self._lock:
+                self._paused_at = time.monotonic()
+        self.player.stop_all()
+        self._seek_to = self.position
+        return False
+
+    def _play_notes(self, starts, frequencies, durations, instrument, position, end):
+        # Notes starting in [position, end), found by binary search in the onsets
+        first = int(np.searchsorted(starts, position, side="left"))
+        last = int(np.searchsorted(starts, end, side="left"))
+        prepared = first
+        # The clock starts once the first look-ahead window is ready, so a
+        # slow first render (cold caches, lazy imports) does not leave the
+        # notes due meanwhile to all fire at once
+        tempo = self.tempo
+        while prepared < last and (prepared == first or starts[prepared] <= position + self.lookahead * tempo):
+            self.player.prepare(instrument, frequencies[prepared], durations[prepared] / tempo)
+            prepared += 1
+        self._start_at(position)
+
+        for index in range(first, last):
+            # Render the next note and everything due within the look-ahead
+            # window before waiting for the onset
+            tempo = self.tempo
+            horizon = self.position + self.lookahead * tempo
+            while prepared <= index or (prepared < last and starts[prepared] <= horizon):
+                self.player.prepare(instrument, frequencies[prepared], durations[prepared] / tempo)
+                prepared += 1
+
+            if not self._wait_for(starts[index]):
+                return False
+            deadline = self._deadline(starts[index])
+            self.player.play(instrument, frequencies[index], durations[index] / self.tempo, blocking=False)
+            self.onset_errors.append(time.monotonic() - deadline)
+        return True
+
+    def _loop_cache_key(self, score, instrument, loop):
+        return (score, instrument, loop, self.tempo, self.player.sample_rate)
+
+    def _cached_loop(self, score, instrument, loop):
+        key = self._loop_cache_key(score, instrument, loop)
+        with self._lock:
+            return self._loop_tone if self._loop_key == key else None
+
+    def _render_loop(self, score, instrument, loop):
+        start, end = loop
+        key = self._loop_cache_key(score, instrument, loop)
+        if (end - start) / self.tempo > self.LOOP_CACHE_SECONDS:
+            return
+        with self._lock:
+            if key == self._loop_key or key == self._loop_rendering:
+                return
+            self._loop_rendering = key
+        threading.Thread(target=self._mix_loop, args=(key,), daemon=True).start()
+
+    def _mix_loop(self, key):
+        score, instrument, (start, end), tempo, sample_rate = key
+        # The renderer is only needed once a loop plays
+        from render import render_score
+
+        notes = score.notes
+        region = np.array(notes[(notes["start"] >= start) & (notes["start"] < end)])
+        region["start"] = (region["start"] - start) / tempo
+        region["duration"] /= tempo
+        tone = None
+        try:
+            tone = render_score(Score(region, (end - start) / tempo), instrument, sample_rate)
+        finally:
+            with self._lock:
+                # Dropped if another region, tempo or score was asked for meanwhile
+                if self._loop_rendering == key:
+                    self._loop_rendering = None
+                    if tone is not None:
+                        self._loop_key, self._loop_tone = key, tone
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Headless, vectorized synthesis of the instrument timbres.
+
+Every function here returns plain NumPy arrays (normalized to [-1, 1]) and
+never touches the audio device, so it can be used for playback, offline
+rendering or benchmarks alike. Batches of notes are rendered together: all
+notes sharing a length are computed as one (notes x samples) matrix, and
+the weighted harmonics come from a recurrence on that matrix instead of one
+np.sin pass per harmonic per note.
+
+Samples are float32 from the harmonic sums to the int16 output. Only the
+phase is computed in float64, since it grows with the length of the note;
+the recurrence, envelopes and normalization then work in place on a fixed
+set of buffers, however many harmonics the timbre has.
+"""
+
+import numpy as np
+
+from wavetable import Oscillator, square_wavetable
+
+# Timbres des instruments
+PIANO_HARMONICS = [1, 2, 3, 4, 5, 6, 7, 8]
+PIANO_WEIGHTS = [0.5, 0.25, 0.1, 0.05, 0.025, 0.0125, 0.00625, 0.003125]
+PIANO_ADSR = (0.01, 0.1, 0.3, 0.1)  # attack, decay, sustain level, release
+
+XYLOPHONE_HARMONICS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+XYLOPHONE_WEIGHTS = [0.5, 0.4, 0.35, 0.3, 0.25, 0.2, 0.15, 0.1, 0.05, 0.03, 0.02, 0.01]
+
+INSTRUMENTS = ("piano", "xylophone", "videogame")
+
+# Upper bound on the number of (notes x samples) elements handled at once
+MAX_MATRIX_ELEMENTS = 128 * 1024
+
+SAMPLE_DTYPE = np.float32
+
+
+def num_samples(duration, sample_rate):
+    return int(sample_rate * duration)
+
+
+def time_axis(duration, sample_rate):
+    # Identique à np.linspace(0, duration, n, False)
+    n = num_samples(duration, sample_rate)
+    return np.arange(n) * (duration / n) if n else np.zeros(0)
+
+
+def adsr_envelope(index, num_samples, attack_percent, decay_percent, sustain_level, release_percent):
+    # Breakpoints of the ADSR envelope, evaluated only at the requested
+    # sample indices so a streaming voice can compute it block by block
+    attack_samples = int(num_samples * attack_percent)
+    decay_samples = int(num_samples * decay_percent)
+    sustain_samples = num_samples - (attack_samples + decay_samples + int(num_samples * release_percent))
+    points = np.cumsum([0, attack_samples, decay_samples, sustain_samples])
+    x = np.append(points, num_samples)
+    y = [0, 1, sustain_level, sustain_level, 0]
+    return np.interp(index, x, y)
+
+
+def create_envelope(num_samples, attack_percent, decay_percent, sustain_level, release_percent):
+    return adsr_envelope(np.arange(num_samples), num_samples, attack_percent, decay_percent, sustain_level, release_percent)
+
+
+def pcm16(tone, channels=2, out=None):
+    """Interleaved int16 frames of a [-1, 1] tone, scaled and cast in one pass.
+
+    `out` is an optional (frames, channels) int16 buffer to reuse; at least
+    len(tone) frames long. Returns the frames that were written.
+    """
+    if out is None:
+        out = np.empty((len(tone), channels), dtype=np.int16)
+    out = out[:len(tone)]
+    np.multiply(tone[:, None], 32767, out=out, casting="unsafe")
+    return out
+
+
+def _group_by_length(frequencies, durations, sample_rate):
+    # Notes of equal length share one time axis and one matrix operation
+    groups = {}
+    for i, duration in enumerate(durations):
+        n = num_samples(duration, sample_rate)
+        groups.setdefault((n, duration), []).append(i)
+    return groups
+
+
+def dense_weights(harmonics, weights):
+    """Weights indexed by harmonic number - 1, or None if a partial is not an integer harmonic."""
+    harmonics = np.asarray(harmonics, dtype=float)
+    if not (np.all(harmonics == np.round(harmonics)) and np.all(harmonics >= 1)):
+        return None
+    dense = np.zeros(int(harmonics.max()))
+    np.add.at(dense, harmonics.astype(int) - 1, weights)
+    return dense
+
+
+def chebyshev_sum(theta, dense):
+    # sin(k*theta) follows the Chebyshev recurrence
+    # sin((k+1)x) = 2cos(x)sin(kx) - sin((k-1)x), so only one sin and one
+    # cos are evaluated per sample whatever the number of harmonics. The
+    # terms rotate through the same three buffers.
+    current = np.sin(theta)
+    dense = np.asarray(dense, dtype=current.dtype)
+    two_cos = np.cos(theta)
+    two_cos *= 2
+    previous = np.zeros_like(current)
+    scratch = np.empty_like(current)
+    tone = current * dense[0]
+    for weight in dense[1:]:
+        np.multiply(two_cos, current, out=scratch)
+        np.subtract(scratch, previous, out=previous)
+        previous, current = current, previous
+        if weight:
+            np.multiply(current, weight, out=scratch)
+            tone += scratch
+    return tone
+
+
+def harmonic_sum(theta, harmonics, weights):
+    """Weighted sum of sin(h * theta) over the harmonics h, for any theta array."""
+    dense = dense_weights(harmonics, weights)
+    if dense is not None:
+        return chebyshev_sum(theta, dense)
+    # Any other partials: one (..., harmonics) matrix product
+    theta = np.asarray(theta)
+    dtype = theta.dtype if theta.dtype.kind == "f" else float
+    return np.sin(np.multiply.outer(theta, np.asarray(harmonics, dtype=dtype))) @ np.asarray(weights, dtype=dtype)
+
+
+def additive_batch(frequencies, durations, harmonics, weights, sample_rate=44100):
+    """Raw harmonic sums for many notes at once, as a list of arrays."""
+    frequencies = np.asarray(frequencies, dtype=float)
+    harmonics = np.asarray(harmonics, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    tones = [None] * len(frequencies)
+
+    for (n, duration), indices in _group_by_length(frequencies, durations, sample_rate).items():
+        if n == 0:
+            for i in indices:
+                tones[i] = np.zeros(0, dtype=SAMPLE_DTYPE)
+            continue
+        t = time_axis(duration, sample_rate)
+        # Split the group so the working matrices stay cache friendly
+        per_chunk = max(1, MAX_MATRIX_ELEMENTS // n)
+        for start in range(0, len(indices), per_chunk):
+            chunk = indices[start:start + per_chunk]
+            # Phase in float64 reduced to one turn, then float32 for the sums
+            theta = np.multiply.outer(2 * np.pi * frequencies[chunk], t)
+            np.remainder(theta, 2 * np.pi, out=theta)
+            theta = theta.astype(SAMPLE_DTYPE)  # Drops the float64 matrix
+            block = harmonic_sum(theta, harmonics, weights.astype(SAMPLE_DTYPE))
+            for row, i in enumerate(chunk):
+                tones[i] = block[row]
+    return tones
+
+
+def _normalize(tone):
+    peak = np.max(np.abs(tone)) if len(tone) else 0
+    if peak:
+        tone *= 1 / peak
+    return tone
+
+
+def piano_batch(frequencies, durations, sample_rate=44100):
+    tones = additive_batch(frequencies, durations, PIANO_HARMONICS, PIANO_WEIGHTS, sample_rate)
+    envelopes = {}
+    for tone in tones:
+        n = len(tone)
+        if n not in envelopes:
+            envelopes[n] = create_envelope(n, *PIANO_ADSR).astype(SAMPLE_DTYPE)
+        tone *= envelopes[n]
+    return [_normalize(tone) for tone in tones]
+
+
+class ResonatorBank:
+    """Memoized xylophone resonators, designed once per frequency.
+
+    Besides the filter coefficients and initial conditions, each design keeps
+    the gain that normalizes the resonated harmonics, computed from the
+    filter's response at every harmonic instead of a scan of the whole note.
+    This lets a voice filter its note block by block, carrying the filter
+    state from one block to the next.
+    """
+
+    def __init__(self, sample_rate=44100):
+        self.sample_rate = sample_rate
+        self._designs = {}
+
+    def __len__(self):
+        return len(self._designs)
+
+    def design(self, frequency):
+        design = self._designs.get(frequency)
+        if design is None:
+            # SciPy is only needed once a xylophone note is designed: importing
+            # scipy.signal costs more than the rest of the start-up
+            from scipy.signal import bilinear, freqz, lfilter_zi
+            b, a = bilinear([1, 0, 0], [1, -2 * 0.95 * np.cos(2 * np.pi * frequency / self.sample_rate), 0.9025], fs=self.sample_rate)
+            zi = lfilter_zi(b, a)
+
+            # Steady state of the filtered harmonics: each one is scaled and
+            # shifted by the filter's response at its own frequency
+            harmonics = np.asarray(XYLOPHONE_HARMONICS, dtype=float)
+            _, response = freqz(b, a, worN=2 * np.pi * frequency * harmonics / self.sample_rate)
+            phase = np.linspace(0, 2 * np.pi, 2048, False)
+            period = (np.sin(np.outer(phase, harmonics) + np.angle(response)) * np.abs(response)) @ XYLOPHONE_WEIGHTS
+            peak = np.max(np.abs(period)) * (0.5 * np.pi)
+            design = (b, a, zi, 1.0 / peak if peak else 0.0)
+            self._designs[frequency] = design
+        return design
+
+    def gain(self, frequency):
+        return self.design(frequency)[3]
+
+    def filter(self, block, frequency, state=None):
+        """Filter one block; pass the returned state along with the next block."""
+        from scipy.signal import lfilter
+        b, a, zi, _ = self.design(frequency)
+        if state is None:
+            state = zi * block[0] if len(block) else zi * 0
+        return lfilter(b, a, block, zi=state)
+
+
+_resonator_banks = {}
+
+
+def resonator_bank(sample_rate=44100):
+    """Shared ResonatorBank for a sample rate."""
+    bank = _resonator_banks.get(sample_rate)
+    if bank is None:
+        bank = _resonator_banks[sample_rate] = ResonatorBank(sample_rate)
+    return bank
+
+
+def xylophone_batch(frequencies, durations, sample_rate=44100):
+    tones = additive_batch(frequencies, durations, XYLOPHONE_HARMONICS, XYLOPHONE_WEIGHTS, sample_rate)
+    bank = resonator_bank(sample_rate)
+    result = []
+    for frequency, tone in zip(frequencies, tones):
+        if not len(tone):
+            result.append(tone)
+            continue
+        tone *= (0.5 * np.pi)
+
+        # Appliquer un filtre de résonance pour simuler la sonorité métallique
+        # The recursion itself stays float64: its poles sit so close to the
+        # unit circle that float32 coefficients shift the output by ~1%
+        tone, _ = bank.filter(tone, frequency)
+        tone = tone.astype(SAMPLE_DTYPE)
+
+        # Apply a quick decay envelope
+        tone *= np.linspace(1, 0, len(tone), dtype=SAMPLE_DTYPE)
+        result.append(_normalize(tone))
+    return result
+
+
+def videogame_batch(frequencies, durations, sample_rate=44100):
+    # Onde carrée, band-limited so the high notes do not alias
+    table = square_wavetable(sample_rate)
+    return [Oscillator(table, frequency, sample_rate).render(num_samples(duration, sample_rate))
+            for frequency, duration in zip(frequencies, durations)]
+
+
+_BATCH_RENDERERS = {
+    "piano": piano_batch,
+    "xylophone": xylophone_batch,
+    "videogame": videogame_batch,
+}
+
+
+def render_batch(instrument, notes, sample_rate=44100):
+    """Render a list of (frequency, duration) pairs; returns one array per note."""
+    if instrument not in _BATCH_RENDERERS:
+        raise ValueError(f"Unknown instrument: {instrument}")
+    if not len(notes):
+        return []
+    frequencies, durations = zip(*notes)
+    return _BATCH_RENDERERS[instrument](frequencies, durations, sample_rate)
+
+
+def render_note(instrument, frequency, duration, sample_rate=44100):
+    return render_batch(instrument, [(frequency, duration)], sample_rate)[0]
@@ -0,0 +1,46 @@
+import numpy as np
+
+from recorder import EVENT_DTYPE, export_score
+
+
+def make_events(notes):
+    # (midi, start, duration) -> journal events
+    events = []
+    for midi, start, duration in notes:
+        events.append((start, midi, True))
+        events.append((start + duration, midi, False))
+    return np.array(events, dtype=EVENT_DTYPE)
+
+
+def export(tmp_path, notes):
+    path = tmp_path / "take.txt"
+    export_score(make_events(notes), str(path))
+    return [line.split() for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def onsets(lines):
+    # Start time of every note line, replaying the score line after line
+    times = []
+    elapsed = 0.0
+    for name, duration in lines:
+        if name != "0":
+            times.append((name, round(elapsed, 3)))
+        elapsed += float(duration)
+    return times
+
+
+def test_leading_silence_is_kept(tmp_path):
+    lines = export(tmp_path, [(60, 0.75, 0.5)])
+    assert lines == [["0", "0.75"], ["C4", "0.5"]]
+
+
+def test_sub_millisecond_note_keeps_later_notes_in_place(tmp_path):
+    notes = [(60, 0.0, 0.5), (62, 0.6, 0.0003), (64, 1.0, 0.25), (65, 1.5, 0.5)]
+    lines = export(tmp_path, notes)
+    assert "D4" not in [name for name, _ in lines]
+    assert onsets(lines) == [("C4", 0.0), ("E4", 1.0), ("F4", 1.5)]
+
+
+def test_notes_starting_together_keep_the_first(tmp_path):
+    lines = export(tmp_path, [(60, 0.0, 0.5), (64, 0.0, 0.5), (67, 1.0, 0.5)])
+    assert onsets(lines) == [("C4", 0.0), ("G4", 1.0)]
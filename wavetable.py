@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Wavetable oscillators.
+
+A timbre made of integer harmonics is stored as one cycle of its waveform,
+sampled TABLE_SIZE times. Because a cycle played faster pushes its upper
+harmonics past the Nyquist frequency, every table is mip-mapped: one version
+per octave of fundamental frequency, keeping only the harmonics that stay
+below Nyquist at the top of that octave. An Oscillator then reads the table
+for its note with a phase accumulator and linear interpolation, so each
+sample costs a lookup instead of one sine per harmonic, and its phase simply
+carries over from one block to the next.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+TABLE_SIZE = 2048
+
+# Fundamental at the bottom of the first mip level
+LOWEST_FREQUENCY = 20.0
+
+
+class Wavetable:
+    """Band-limited single-cycle tables of a harmonic timbre, one per octave.
+
+    With `normalize`, every table is scaled to a peak of 1 on its own, so a
+    timbre keeps its loudness in every octave whatever harmonics it lost.
+    """
+
+    def __init__(self, harmonics, weights, sample_rate=44100, size=TABLE_SIZE, normalize=False):
+        self.sample_rate = sample_rate
+        self.size = size
+        harmonics = np.asarray(harmonics, dtype=int)
+        weights = np.asarray(weights, dtype=float)
+
+        nyquist = sample_rate / 2
+        self.tables = []
+        top = LOWEST_FREQUENCY * 2
+        while True:
+            # Harmonics that stay below Nyquist for every note of this octave
+            limit = min(max(int(nyquist // top), 1), size // 2 - 1)
+            keep = harmonics <= limit
+            # sum(w * sin(h * theta)) as an inverse real FFT of its spectrum
+            spectrum = np.zeros(size // 2 + 1, dtype=complex)
+            np.add.at(spectrum, harmonics[keep], -0.5j * size * weights[keep])
+            table = np.fft.irfft(spectrum, size)
+            if normalize:
+                table /= np.max(np.abs(table))
+            # Guard point for interpolation; samples are float32 like the rest of the pipeline
+            self.tables.append(np.append(table, table[0]).astype(np.float32))
+            if limit == 1:
+                break
+            top *= 2
+        self.peak = max(np.max(np.abs(table)) for table in self.tables)
+
+    def table(self, frequency):
+        """The table to play `frequency` with."""
+        level = int(np.ceil(np.log2(max(frequency, LOWEST_FREQUENCY) / LOWEST_FREQUENCY))) - 1
+        return self.tables[min(max(level, 0), len(self.tables) - 1)]
+
+
+class Oscillator:
+    """Phase accumulator reading a wavetable, continuous across blocks."""
+
+    def __init__(self, wavetable, frequency, sample_rate=44100, phase=0.0):
+        self.table = wavetable.table(frequency)
+        self.size = wavetable.size
+        self.increment = frequency / sample_rate  # Cycles per sample
+        self.phase = phase
+
+    def render(self, frames):
+        phase = self.phase + self.increment * np.arange(frames)
+        self.phase = (self.phase + self.increment * frames) % 1.0
+        position = (phase % 1.0) * self.size
+        index = position.astype(np.intp)
+        position -= index
+        fraction = position.astype(np.float32)
+        table = self.table
+        tone = table[index + 1]
+        tone -= table[index]
+        tone *= fraction
+        tone += table[index]
+        return tone
+
+
+@lru_cache(maxsize=None)
+def wavetable(harmonics, weights, sample_rate=44100):
+    """Shared Wavetable for a timbre (harmonics and weights as tuples)."""
+    return Wavetable(harmonics, weights, sample_rate)
+
+
+@lru_cache(maxsize=None)
+def square_wavetable(sample_rate=44100):
+    # Série de Fourier du carré : (4 / pi) * sin(k * theta) / k, k impair,
+    # scaled to the same peak as np.sign(np.sin(...))
+    harmonics = np.arange(1, TABLE_SIZE // 2, 2)
+    return Wavetable(harmonics, 4 / (np.pi * harmonics), sample_rate, normalize=True)